@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""Geometry microbenchmark, CubicBezier and CurvedText fitting.
+
+Run from the project root, e.g.
+	python benchmarks/geometry.py --baseline HEAD~1
+
+With a baseline the neferset package is also extracted from that git
+revision and measured in the same way, for a before and after comparison.
+"""
+
+import os
+import sys
+import json
+import subprocess
+import tempfile
+import fire
+
+# run in a subprocess, with the package to measure first on the path
+MEASURE = r"""
+import sys, json, timeit
+from neferset.curved import CubicBezier, CurvedText
+from neferset.geometry import Point, Vector4
+
+number = int(sys.argv[1])
+curve = CubicBezier(10, 200, 150, 20, 350, 20, 490, 200)
+fit = CurvedText.__new__(CurvedText)
+fit.curve = curve
+p, q = Point(1.5, 2.5), Point(3.5, 0.5)
+v, t = Vector4(0.5, 0.4, 0.3, 0.9), Vector4(1, 0.9, 0.8, 1)
+tests = {
+	"CubicBezier.estimate_length": lambda: curve.estimate_length(100),
+	"CubicBezier.parametrize": lambda: curve.parametrize(0.37),
+	"CubicBezier.evaluate": lambda: curve.evaluate(0.37),
+	"CurvedText._fit": lambda: fit._fit(300, 150, 10, (0.1, 0.9)),
+	"Point arithmetic": lambda: (p + q) * 0.5 - p,
+	"Vector4 blend": lambda: (v * t * 0.7) * v - v,
+}
+results = {}
+for name, func in tests.items():
+	best = min(timeit.repeat(func, number=number, repeat=5))
+	results[name] = best / number * 1e6
+print(json.dumps(results))
+"""
+
+
+def measure(root, number):
+	env = dict(os.environ, PYTHONPATH=root)
+	out = subprocess.run(
+		[sys.executable, "-c", MEASURE, str(number)], env=env, check=True,
+		stdout=subprocess.PIPE, universal_newlines=True).stdout
+	return json.loads(out)
+
+
+def extract(revision, dest):
+	"""Extract the neferset package from a git revision into dest."""
+	files = subprocess.run(
+		["git", "ls-tree", "--name-only", revision, "neferset/"], check=True,
+		stdout=subprocess.PIPE, universal_newlines=True).stdout.split()
+	os.makedirs(os.path.join(dest, "neferset"))
+	for name in files:
+		data = subprocess.run(
+			["git", "show", "{}:{}".format(revision, name)], check=True,
+			stdout=subprocess.PIPE).stdout
+		with open(os.path.join(dest, name), "wb") as f:
+			f.write(data)
+
+
+def geometry(baseline=None, number=10000):
+	"""Time the geometry hot paths, in microseconds per call.
+
+	-- baseline	a git revision to compare against
+	-- number	calls per timing run
+	"""
+	current = measure(os.getcwd(), number)
+	if not baseline:
+		print("| operation | us/call |")
+		print("|---|---|")
+		for name, us in current.items():
+			print("| {} | {:.2f} |".format(name, us))
+		return
+	with tempfile.TemporaryDirectory() as tmp:
+		extract(baseline, tmp)
+		before = measure(tmp, number)
+	print("| operation | {} us/call | current us/call | speedup |".format(baseline))
+	print("|---|---|---|---|")
+	for name, us in current.items():
+		print("| {} | {:.2f} | {:.2f} | {:.2f}x |".format(
+			name, before[name], us, before[name] / us))
+
+
+if __name__ == "__main__":
+	fire.Fire(geometry)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""Quality preset benchmark, render time and image difference per preset.
+
+Run from the project root, e.g.
+	python benchmarks/quality.py --query "set=EXPERT1 and cost>=7"
+
+Each preset renders the same cards, the images are compared with the
+normal preset's by PSNR (higher is closer, inf is identical) and by the
+largest difference of any pixel channel. The time per card is the render
+time reported by generate, without the startup. With --record_readme the table
+is saved in the README's quality presets section.
+"""
+
+import re
+import sys
+import math
+import time
+import os.path
+import subprocess
+import tempfile
+import fire
+from PIL import Image, ImageChops
+
+PRESETS = ("draft", "normal", "release")
+REFERENCE = "normal"
+README = "README.md"
+MARKERS = ("<!-- quality results -->", "<!-- end quality results -->")
+
+
+def psnr(a, b):
+	diff = ImageChops.difference(a.convert("RGBA"), b.convert("RGBA"))
+	hist = diff.histogram()
+	squares = sum(v * (i % 256) ** 2 for i, v in enumerate(hist))
+	mse = squares / float(a.size[0] * a.size[1] * 4)
+	if mse == 0:
+		return float("inf")
+	return 10 * math.log10(255 ** 2 / mse)
+
+
+def max_difference(a, b):
+	diff = ImageChops.difference(a.convert("RGBA"), b.convert("RGBA"))
+	return max(high for _, high in diff.getextrema())
+
+
+def record(table, description):
+	"""Replace the results between the markers in the README."""
+	with open(README) as f:
+		text = f.read()
+	start, end = text.index(MARKERS[0]), text.index(MARKERS[1])
+	text = "{}{}\n{}\n\n{}\n{}".format(
+		text[:start], MARKERS[0], description, "\n".join(table), text[end:])
+	with open(README, "w") as f:
+		f.write(text)
+
+
+def quality(
+		only=None, query="set=EXPERT1 and cost>=7", style="default", width=0,
+		record_readme=False):
+	"""Measure render time, output size and the difference from normal per preset.
+
+	-- only		comma separated card ids, instead of the query
+	-- query	the cards to render
+	-- style	the HearthForge style to render with
+	-- width	the output width
+	-- record_readme	save the table in the README
+	"""
+	selection = ["--only", only] if only else ["--query", query]
+	with tempfile.TemporaryDirectory() as tmp:
+		times = {}
+		for preset in PRESETS:
+			out_dir = os.path.join(tmp, preset)
+			os.makedirs(out_dir)
+			done = subprocess.run(
+				[sys.executable, "generate.py", "--quality", preset, "--style", style,
+					"--width", str(width), "--out-dir", out_dir] + selection,
+				check=True, stdout=subprocess.PIPE, universal_newlines=True)
+			times[preset] = float(re.search(r"actual ([\d.]+)s", done.stdout).group(1))
+		ref_dir = os.path.join(tmp, REFERENCE)
+		names = sorted(n for n in os.listdir(ref_dir) if n.endswith(".png"))
+		table = [
+			"| preset | time per card (ms) | size (KB) | mean PSNR vs {0} (dB) "
+			"| max diff vs {0} |".format(REFERENCE),
+			"|---|---|---|---|---|"]
+		for preset in PRESETS:
+			out_dir = os.path.join(tmp, preset)
+			size = sum(os.path.getsize(os.path.join(out_dir, n)) for n in names)
+			scores, diffs = [], []
+			for n in names:
+				with Image.open(os.path.join(out_dir, n)) as a, \
+						Image.open(os.path.join(ref_dir, n)) as b:
+					scores.append(psnr(a, b))
+					diffs.append(max_difference(a, b))
+			finite = [s for s in scores if s != float("inf")]
+			mean = sum(finite) / len(finite) if finite else float("inf")
+			table.append("| {} | {:.1f} | {:.0f} | {:.1f} | {} |".format(
+				preset, times[preset] / max(1, len(names)) * 1000, size / 1024, mean,
+				max(diffs, default=0)))
+	print("\n".join(table))
+	if record_readme:
+		record(table, "{} cards ({}), style {}, width {}:".format(
+			len(names), only or query, style, width or "theme"))
+
+
+if __name__ == "__main__":
+	fire.Fire(quality)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""Stat number sprites, compared with drawing the text for 0-99.
+
+Run from the project root, e.g.
+	python benchmarks/sprites.py --style default --width 512
+
+For each cost, attack and health component of the style the numbers are
+drawn with drawing.text and drawing.text_sprite on separate surfaces, the
+largest difference of any pixel channel and the time per number are shown.
+The sprites must match the text exactly, the exit status is 1 when any
+pixel differs. With the normal preset (subpixel text) the sprites fall back
+to drawing the text, check the draft and release presets.
+"""
+
+import sys
+import os.path
+import time
+import cairo
+import fire
+from neferset.component import ComponentType
+from neferset.drawing import text, text_sprite, clear_sprites
+from neferset.theme import compile_theme
+from neferset import quality as presets
+
+STATS = (ComponentType.cost, ComponentType.attack, ComponentType.health)
+
+
+def surface_for(theme, width):
+	scale = width / theme.width if width else 1
+	surface = cairo.ImageSurface(
+		cairo.FORMAT_ARGB32, int(round(theme.width * scale)),
+		int(round(theme.height * scale)))
+	ctx = cairo.Context(surface)
+	ctx.set_antialias(presets.current.shape_antialias)
+	ctx.scale(scale, scale)
+	return (surface, ctx)
+
+
+def max_difference(a, b):
+	a.flush()
+	b.flush()
+	return max((abs(x - y) for x, y in zip(bytes(a.get_data()), bytes(b.get_data()))),
+		default=0)
+
+
+def sprites(style="default", width=0, lang="en-US", quality="release"):
+	"""Check and time the stat sprites of a style.
+
+	-- style	the HearthForge style to use
+	-- width	the output width, as in generate
+	-- lang		the language the numbers are laid out in
+	-- quality	the render preset, as in generate
+	"""
+	presets.set_quality(quality)
+	worst = 0
+	theme = compile_theme(os.path.join("assets", "styles", style))
+	print("| card type | component | max diff | text (ms) | sprite (ms) |")
+	print("|---|---|---|---|---|")
+	for card_type, components in sorted(theme.card_types.items()):
+		for c in components:
+			if c.type not in STATS or not c.text or not c.font:
+				continue
+			clear_sprites()
+			drawn, timed = {}, {}
+			for name, draw in (("text", text), ("sprite", text_sprite)):
+				surfaces = [surface_for(theme, width) for n in range(100)]
+				start = time.perf_counter()
+				for n, (surface, ctx) in enumerate(surfaces):
+					draw(ctx, c.text, str(n), c.font, lang)
+				# ms per number, the sprites are rendered on first use
+				timed[name] = (time.perf_counter() - start) * 10
+				drawn[name] = [surface for surface, _ in surfaces]
+			diff = max(max_difference(a, b) for a, b in zip(drawn["text"], drawn["sprite"]))
+			worst = max(worst, diff)
+			print("| {} | {} | {} | {:.3f} | {:.3f} |".format(
+				card_type, c.name, diff, timed["text"], timed["sprite"]))
+	if worst:
+		print("Sprites differ from the text by up to {}".format(worst))
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	fire.Fire(sprites)
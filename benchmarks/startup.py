@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""Startup benchmark, the time to import and to render a single card.
+
+Run from the project root, e.g.
+	python benchmarks/startup.py --only EX1_001 --runs 5 --record startup.jsonl
+
+The first render also builds the card db cache if it is out of date, so it
+is reported separately from the median of the remaining runs.
+"""
+
+import sys
+import json
+import time
+import statistics
+import subprocess
+import tempfile
+import fire
+
+IMPORT_SCRIPT = (
+	"import time; start = time.perf_counter(); import generate; "
+	"print(time.perf_counter() - start)"
+)
+
+
+def timed(args):
+	start = time.perf_counter()
+	subprocess.run(args, check=True, stdout=subprocess.DEVNULL)
+	return time.perf_counter() - start
+
+
+def startup(only="EX1_001", runs=5, style="default", record=None):
+	"""Measure import and time-to-first-card.
+
+	-- only		the card id to render
+	-- runs		the number of times to run each measurement
+	-- style	the HearthForge style to render with
+	-- record	append the results to this JSON lines file
+	"""
+	imports = []
+	for _ in range(runs):
+		out = subprocess.run(
+			[sys.executable, "-c", IMPORT_SCRIPT],
+			check=True, stdout=subprocess.PIPE, universal_newlines=True)
+		imports.append(float(out.stdout.strip().splitlines()[-1]))
+	helps = [timed([sys.executable, "generate.py", "--help"]) for _ in range(runs)]
+	with tempfile.TemporaryDirectory() as out_dir:
+		cards = [
+			timed([sys.executable, "generate.py", "--only", only,
+				"--style", style, "--out-dir", out_dir])
+			for _ in range(runs)]
+	results = {
+		"time": time.time(),
+		"card": only,
+		"import": statistics.median(imports),
+		"help": statistics.median(helps),
+		"first_card_initial": cards[0],
+		"first_card": statistics.median(cards[1:] or cards)
+	}
+	for k in ("import", "help", "first_card_initial", "first_card"):
+		print("{:<20} {:.3f}s".format(k, results[k]))
+	if record:
+		with open(record, "a") as f:
+			f.write(json.dumps(results) + "\n")
+
+
+if __name__ == "__main__":
+	fire.Fire(startup)
@@ -1,89 +1,60 @@
 #!/usr/bin/env python
 
 import sys
-import math
 import re
 import json
 import os.path
-from operator import itemgetter, attrgetter
-import fire
-import cairo
-import gi
-
-gi.require_version("Pango", "1.0")
-gi.require_version("PangoCairo", "1.0")
-
-from gi.repository import Pango
-from gi.repository import PangoCairo
-from hearthstone.cardxml import load
+import time
+import signal
+import functools
+import contextlib
 from hearthstone.enums import (
 	CardType, CardSet, CardClass, MultiClassGroup, Locale, get_localized_name
 )
-from neferset.curved import CubicBezier, CurvedText, curved_text
-from neferset.drawing import (
-	rectangle, rect_ellipse, draw_png_asset, text, text_block, polygon
+from neferset.drawing import clear_sprites
+from neferset.raster import (
+	text_case, output_scale, rasterize, rasterize_plans
+)
+from neferset.component import ComponentType, ComponentData
+from neferset.theme import (
+	compile_theme, load_theme_json, save_bundle, load_bundle
+)
+from neferset.fonts import theme_families, prewarm_fonts
+from neferset.assets import AssetIndex, use_index, exists
+import neferset.assets
+from neferset.pool import SurfacePool
+import neferset.quality
+import neferset.metrics
+from neferset.metrics import RunMetrics
+from neferset.artstore import ArtStore, RecentArt, build_store
+from neferset.derivative import (
+	DerivativeCache, build_derivatives, load_index, save_index
+)
+from neferset.output import (
+	FileSink, AtlasSink, ArchiveSink, EncodedSink, DedupSink, variant_name
 )
-import neferset.custom
-from neferset.component import (
-	ComponentType, ShapeType, Region, Shape, Image, Text, Clip, Curve,
-	Component, ComponentData
+from neferset.parallel import fork_map, WorkerStats, memory_usage
+from neferset.carddb import load_db
+from neferset.query import CardIndex
+from neferset.cost import render_cost, CardTimings, makespan
+from neferset.shard import (
+	parse_shard, assign_shards, write_manifest, find_manifests, merge_manifests
 )
+from neferset.jobqueue import JobQueue, LeaseHeartbeat, worker_name
+from neferset.watch import Watcher, changed_card_types, asset_references
 
 OUT_DIR = "./out"
 ART_DIR = "./art"
+ART_STORE_DIR = "./.cache/art"
+DERIVATIVE_DIR = "./.cache/portraits"
+QUEUE_DB = "./jobs.db"
 ASSET_DIR = "./assets/styles"
 DB_XML = "./hsdata/CardDefs.xml"
 THEME_JSON = "data.json"
+ARCHIVE_NAME = "cards"
+BUNDLE_FMT = "./.cache/theme_{}.bundle"
+TIMINGS_JSON = "./.cache/timings.json"
 PREM_SUFFIX = "_premium"
-MIN_WIDTH = 128
-
-
-def draw_clip_region(ctx, obj):
-	polygon(ctx, obj.points, False, 0.01)
-
-
-def text_case(case, text):
-	if case == "upper":
-		return text.upper()
-	elif case == "lower":
-		return text.lower()
-	return text
-
-
-def render_component(context, art_dir, theme_dir, loc_code, component, data):
-	clipped = False
-	# first check if there is a clipping region
-	if component.clip:
-		draw_clip_region(context, component.clip)
-		context.clip()
-		clipped = True
-	# draw image
-	if component.image and data.override:
-		draw_png_asset(context, component.image, art_dir, data.override)
-		if clipped:
-			context.reset_clip()
-			clipped = False
-	elif component.image and data.key in component.image.assets:
-		draw_png_asset(context, component.image, theme_dir, data.key)
-		if clipped:
-			context.reset_clip()
-			clipped = False
-	# draw text
-	if component.text and component.font and data.text:
-		if component.font.case:
-			data.text = text_case(component.font.case, data.text)
-		if component.font.type == "textBlock":
-			text_block(context, component.text, data.text, component.font, loc_code)
-		else:
-			text(context, component.text, data.text, component.font, loc_code)
-	# draw curved text if any
-	if component.curve and component.font and data.text:
-		curved_text(context, component.curve, data.text, component.font)
-	# custom handling, use named function of custom module
-	if component.custom:
-		if hasattr(neferset.custom, component.custom["name"]):
-			func = getattr(neferset.custom, component.custom["name"])
-			func(context, component, data.obj)
 
 
 def plural_index(num, locale):
@@ -131,6 +102,7 @@ def format_plurals(text, locale):
 	return text
 
 
+@functools.lru_cache(maxsize=None)
 def clean_description_text(text, locale):
 	"""Remove the non-markup tags from the card description text.
 
@@ -156,19 +128,6 @@ def clean_description_text(text, locale):
 	return text
 
 
-def setup_context(width, height, out_width=0):
-	scale = 1
-	if out_width >= MIN_WIDTH:
-		scale = out_width / width
-	surface = cairo.ImageSurface(
-		cairo.FORMAT_ARGB32, int(round(width * scale)), int(round(height * scale)))
-	ctx = cairo.Context(surface)
-	ctx.scale(scale, scale)
-	ctx.set_source_rgba(0, 0, 0, 0) # transparent bg
-	ctx.paint()
-	return (ctx, surface)
-
-
 def locale_converter(locale_str):
 	"""Covnert locale string to hearthstone.enums.Locale."""
 	loc = Locale.UNKNOWN
@@ -196,35 +155,34 @@ def card_set_converter(card_set):
 	return cset
 
 
-def load_cards(locale_str, ids, card_set, collectible):
-	"""Load card data from XML.
+def load_cards(locale_str, ids, card_set, collectible, query=None):
+	"""Load card data from XML, returns a generator of the selected cards, so
+	they can be rendered as they are selected.
 
 	locale_str -- the hearthstone.enums.Locale data to load
 	ids -- a list of card ids, takes precedence over set and collectible
 	card_set -- restrict generation to a hearthstone.enums.CardSet
 	collectible -- when True only generate collectible cards
+	query -- a neferset.query expression the cards must also match
 	"""
-	db, xml = load(DB_XML, locale_str)
-	cards = []
+	db = load_db(DB_XML, locale_str)
 	if ids == None:
-		for card in db.values():
-			include = True
-			if collectible:
-				include = True if card.collectible else False
-			if card_set:
-				if card_set == card.card_set:
-					include = include and True
-				else:
-					include = include and False
-			if include:
-				cards.append(card)
-	else:
-		for id in ids:
-			if id in db:
-				cards.append(db[id])
-			else:
-				print("Unknown card id {}, Skipping".format(id))
-	return cards
+		index = CardIndex(db)
+		selected = index.query(query) if query else set(index.all)
+		if collectible:
+			selected &= index.lookup("collectible", True)
+		if card_set:
+			selected &= index.lookup("set", card_set)
+		return index.select(selected)
+	return cards_by_id(db, ids)
+
+
+def cards_by_id(db, ids):
+	for id in ids:
+		if id in db:
+			yield db[id]
+		else:
+			print("Unknown card id {}, Skipping".format(id))
 
 
 def fix_card_props(card, premium):
@@ -243,125 +201,1011 @@ def fix_card_props(card, premium):
 	return (card_type, card_class)
 
 
-def render(card, locale, loc_code, premium, theme_data, theme_dir, art_dir, out_dir, font_map, width):
+def component_data(c, card, locale, premium, card_type, card_class, theme_dir):
+	"""Match a component to the card data it displays, None if not shown."""
+	cdata = None
+	if c.type == ComponentType.name:
+		cdata = ComponentData(text=card.name)
+	elif c.type == ComponentType.elite and card.elite:
+		cdata = ComponentData()
+	elif (c.type == ComponentType.rarity
+			and card.rarity.craftable
+			and card.card_set != CardSet.CORE):
+		cdata = ComponentData(card.rarity.name.lower())
+	elif (c.type == ComponentType.cardSet):
+		cdata = ComponentData(card.card_set.name.lower())
+	elif (c.type == ComponentType.multiClass
+			and card.multi_class_group != MultiClassGroup.INVALID):
+		cdata = ComponentData(card.multi_class_group.name.lower())
+	elif c.type == ComponentType.classDecoration:
+		cdata = ComponentData(card_class, card_class)
+	elif c.type == ComponentType.cost:
+		cdata = ComponentData(text=str(card.cost))
+	elif c.type == ComponentType.health:
+		health = str(card.health)
+		if card.type == CardType.WEAPON:
+			health = str(card.durability)
+		cdata = ComponentData(text=health)
+	elif c.type == ComponentType.attack:
+		cdata = ComponentData(text=str(card.atk))
+	elif c.type == ComponentType.race and card.race.visible:
+		cdata = ComponentData(text=get_localized_name(card.race, locale.name))
+	elif c.type == ComponentType.portrait:
+		cdata = ComponentData(None, None, card.id + ".png")
+	elif c.type == ComponentType.base:
+		cdata = ComponentData()
+	elif c.type == ComponentType.description:
+		cdata = ComponentData(text=clean_description_text(card.description, locale))
+	elif c.type == ComponentType.custom:
+		cdata = ComponentData(
+			obj={
+				"card": card,
+				"dir": theme_dir,
+				"premium": premium,
+				"cardtype": card_type
+			}
+		)
+	elif c.type == ComponentType.unknown:
+		cdata = ComponentData()
+	return cdata
+
+
+def plan_card(card, locale, loc_code, premium, theme, width):
+	"""Resolve the card data against the theme, the first stage of rendering.
+
+	Returns a render plan, the JSON serializable list of components to draw
+	with their text, asset keys, artwork and custom drawing, see
+	neferset.raster. None when the card type is not in the theme.
+	"""
+	# loaded when cards are planned, not for --help or the queue commands
+	import neferset.custom
 	card_type, card_class = fix_card_props(card, premium)
-	if card_type in theme_data:
-		data = theme_data[card_type]
-	else:
+	components = theme.components(card_type)
+	if components is None:
 		print("{} : '{}' is unsupported in '{}' theme".format(
-			card.id, card_type, theme_data["name"]))
+			card.id, card_type, theme.name))
+		neferset.metrics.outcome("unsupported", card_type)
+		return None
+	layers = []
+	for c in components:
+		# match each component to a known type
+		cdata = component_data(
+			c, card, locale, premium, card_type, card_class, theme.dir)
+		if not cdata:
+			continue
+		layer = {"component": c.name}
+		if cdata.key != "default":
+			layer["key"] = cdata.key
+		if cdata.text:
+			text = cdata.text
+			if c.text and c.font and c.font.case:
+				text = text_case(c.font.case, text)
+			layer["text"] = text
+		if cdata.override:
+			layer["art"] = cdata.override
+		if c.custom and cdata.obj:
+			layer["custom"] = neferset.custom.resolve(c, cdata.obj)
+		layers.append(layer)
+	return {
+		"name": "{}{}".format(card.id, PREM_SUFFIX if premium else ""),
+		"card": card.id,
+		"locale": locale.name,
+		"lang": loc_code,
+		"premium": premium,
+		"style": os.path.basename(os.path.normpath(theme.dir)),
+		"type": card_type,
+		"width": width,
+		"layers": layers
+	}
+
+
+def render(card, locale, loc_code, premium, theme, art_dir, sink, width, pool=None, art_store=None):
+	start = time.perf_counter()
+	plan = plan_card(card, locale, loc_code, premium, theme, width)
+	neferset.metrics.stage("plan", time.perf_counter() - start)
+	if plan is None:
+		return None
+	return rasterize(plan, theme, art_dir, sink, pool, art_store)
+
+
+def load_theme(style, font_map=None, bundle=None, cull=False):
+	"""Load a compiled theme bundle, or compile the theme from the
+	hearthforge submodule, raises ThemeError when it has errors."""
+	if bundle:
+		theme = load_bundle(bundle, font_map)
+	else:
+		theme = compile_theme(os.path.join(ASSET_DIR, style), font_map, cull=cull)
+	theme.validate()
+	for c in theme.culling_report():
+		print("Culled: {}".format(c))
+	return theme
+
+
+def card_signature(card):
+	"""The card attributes that are used when rendering."""
+	return (
+		card.name, card.description, card.cost, card.atk, card.health,
+		card.durability, card.type, card.card_class, card.rarity, card.card_set,
+		card.race, card.multi_class_group, card.elite)
+
+
+def changed_refs(changed, theme, art_dir):
+	"""Split changed files into portrait names and theme asset references."""
+	portraits = set()
+	refs = []
+	for path in changed:
+		if os.path.dirname(path) == os.path.normpath(art_dir):
+			portraits.add(os.path.basename(path))
+		elif path.startswith(os.path.normpath(theme.dir) + os.sep):
+			refs.extend(asset_references(theme.data, os.path.relpath(path, theme.dir)))
+	return (portraits, refs)
+
+
+def affected_cards(cards, portraits, refs, theme, locale, premium):
+	"""Find the cards that display any of the changed portraits or theme files.
+
+	A keyed asset (e.g. a rarity gem) only affects the cards that select that
+	key, any other theme file affects every card of the types that use it.
+	"""
+	affected = []
+	variants = (False, True) if premium else (False,)
+	for card in cards:
+		if card.id + ".png" in portraits:
+			affected.append(card)
+			continue
+		for prem in variants:
+			card_type, card_class = fix_card_props(card, prem)
+			if is_affected(card, locale, prem, card_type, card_class, theme, refs):
+				affected.append(card)
+				break
+	return affected
+
+
+def is_affected(card, locale, premium, card_type, card_class, theme, refs):
+	for ref_type, name, key in refs:
+		if ref_type != card_type:
+			continue
+		if key is None:
+			return True
+		for c in theme.components(card_type) or []:
+			if c.name != name:
+				continue
+			cdata = component_data(
+				c, card, locale, premium, card_type, card_class, theme.dir)
+			if cdata and cdata.key == key:
+				return True
+	return False
+
+
+def watch_cards(
+		cards, reload_cards, render_cards, theme, art_dir, locale, premium,
+		art_store=None):
+	"""Watch the theme, artwork and card data, re-rendering affected cards."""
+	import neferset.custom
+	theme_json = os.path.normpath(os.path.join(theme.dir, THEME_JSON))
+	db_xml = os.path.normpath(DB_XML)
+	watcher = Watcher([theme.dir, art_dir, DB_XML])
+	print("Watching for changes, Ctrl+C to stop")
+	try:
+		while True:
+			changed = watcher.wait()
+			affected = {}
+			if db_xml in changed:
+				old = {c.id: card_signature(c) for c in cards}
+				# the file may still be being written, keep the cards until it loads
+				try:
+					new_cards = reload_cards()
+				except (ValueError, OSError, SyntaxError) as e:
+					print("Card data not reloaded: {}".format(e))
+				else:
+					cards = new_cards
+					affected.update((c.id, c) for c in cards
+						if old.get(c.id) != card_signature(c))
+			if neferset.assets.INDEX:
+				neferset.assets.INDEX.refresh(changed)
+			for path in changed:
+				theme.discard(path)
+			new_data = None
+			if theme_json in changed:
+				# half saved or mistyped while editing, keep the previous compile
+				try:
+					new_data = load_theme_json(theme.dir)
+				except (ValueError, OSError) as e:
+					print("Theme not reloaded: {}".format(e))
+			if new_data is not None:
+				types = changed_card_types(theme.data, new_data)
+				theme.compile(new_data)
+				for e in theme.errors:
+					print("Theme: {}".format(e))
+				clear_sprites()
+				# theme settings may be used by the cached custom images
+				neferset.custom.clear_caches(theme.dir)
+				for c in cards:
+					if any(fix_card_props(c, p)[0] in types for p in (False, True)):
+						affected[c.id] = c
+			portraits, refs = changed_refs(changed, theme, art_dir)
+			for c in affected_cards(cards, portraits, refs, theme, locale, premium):
+				affected[c.id] = c
+			# custom components may have cached images made from the file
+			if any(key is None for _, _, key in refs):
+				neferset.custom.clear_caches(theme.dir)
+			if art_store:
+				for name in portraits:
+					art_store.refresh(art_dir, name)
+			print("{} files changed, rendering {} cards".format(len(changed), len(affected)))
+			render_cards(affected.values())
+	except KeyboardInterrupt:
+		pass
+
+
+def warm_fonts(theme, locale):
+	"""Resolve the theme's fonts for a locale before rendering starts."""
+	for warning in prewarm_fonts(theme_families(theme), locale.name, locale_as_code(locale)):
+		print("Warning: {}".format(warning))
+
+
+def parse_font_map(fonts):
+	"""Create a font replacer map ( e.g. "Arial=Times;OpenSans=Roboto")"""
+	return dict(f.split("=") for f in fonts.split(";")) if fonts else None
+
+
+def as_list(value):
+	"""Fire gives a tuple for a comma separated option, otherwise a value."""
+	if value is None:
+		return None
+	return list(value) if isinstance(value, (tuple, list)) else [value]
+
+
+def render_variants(card, variants, loc, loc_code, targets, art_dir, width, pool=None, store=None):
+	"""Render the standard card then the premium if required, in each of the
+	(output prefix, theme, sink) targets, returns the names of the outputs
+	written and the number of renders that failed."""
+	names = []
+	failed = 0
+	for prefix, theme, sink in targets:
+		for prem in variants:
+			# a failed card is counted and the run carries on, as in worker
+			try:
+				name = render(card, loc, loc_code, prem, theme, art_dir, sink, width, pool, store)
+			except Exception as e:
+				print("{}{} failed: {}: {}".format(prefix, card.id, type(e).__name__, e))
+				neferset.metrics.outcome("failed", type(e).__name__)
+				failed += 1
+				continue
+			if name:
+				names.append(prefix + name)
+	return (names, failed)
+
+
+def render_task(state, index):
+	"""Render a card in a forked worker process, see neferset.parallel."""
+	card = state["cards"][index]
+	targets = state["targets"]
+	start = time.perf_counter()
+	names, failed = render_variants(
+		card, state["variants"], state["loc"], state["loc_code"], targets,
+		state["art_dir"], state["width"], state["pool"], state["store"])
+	encoded = [(i, e) for i, (_, _, sink) in enumerate(targets)
+		if isinstance(sink, EncodedSink) for e in sink.take()]
+	return (
+		index, names, failed, encoded, time.perf_counter() - start,
+		neferset.metrics.take())
+
+
+def preflight(cards, themes, art_dir, loc, variants, store=None):
+	"""Find the files the cards need that are missing, before rendering.
+
+	Returns two dicts of missing file path to the ids of the cards using
+	it, for the portraits and for the theme files used by custom components.
+	Portraits the art store or derivatives (store) have are not missing.
+	"""
+	import neferset.custom
+	missing_art, missing_files = {}, {}
+	for card in cards:
+		for theme in themes:
+			for prem in variants:
+				card_type, card_class = fix_card_props(card, prem)
+				for c in theme.components(card_type) or []:
+					cdata = component_data(
+						c, card, loc, prem, card_type, card_class, theme.dir)
+					if not cdata:
+						continue
+					if c.image and cdata.override:
+						path = os.path.join(art_dir, cdata.override)
+						name = c.image.assets.get(cdata.override, cdata.override)
+						if not exists(path) and not (store and store.has(name)):
+							missing_art.setdefault(path, set()).add(card.id)
+					elif c.type == ComponentType.custom and c.custom:
+						for path in neferset.custom.required_files(c, cdata.obj):
+							if not exists(path):
+								missing_files.setdefault(path, set()).add(card.id)
+	return (missing_art, missing_files)
+
+
+def report_missing(kind, missing, limit=10):
+	if not missing:
 		return
-	# get all the components and sort by the layer attribute
-	components = []
-	for k, v in data.items():
-		try:
-			ctype = ComponentType[k]
-		except KeyError:
-			ctype = ComponentType.unknown
-		components.append(Component(v, ctype, font_map))
-	components.sort(key=attrgetter("layer"))
+	cards = set().union(*missing.values())
+	print("Missing {}: {} files, used by {} cards".format(kind, len(missing), len(cards)))
+	for path in sorted(missing)[:limit]:
+		print("  {}".format(path))
+	if len(missing) > limit:
+		print("  ... and {} more".format(len(missing) - limit))
 
-	ctx, surface = setup_context(theme_data["width"], theme_data["height"], width)
-	rendered_comps = 0
 
-	for c in components:
-		cdata = None
-		# match each component to a known type
-		if c.type == ComponentType.name:
-			cdata = ComponentData(text=card.name)
-		elif c.type == ComponentType.elite and card.elite:
-			cdata = ComponentData()
-		elif (c.type == ComponentType.rarity
-				and card.rarity.craftable
-				and card.card_set != CardSet.CORE):
-			cdata = ComponentData(card.rarity.name.lower())
-		elif (c.type == ComponentType.cardSet):
-			cdata = ComponentData(card.card_set.name.lower())
-		elif (c.type == ComponentType.multiClass
-				and card.multi_class_group != MultiClassGroup.INVALID):
-			cdata = ComponentData(card.multi_class_group.name.lower())
-		elif c.type == ComponentType.classDecoration:
-			cdata = ComponentData(card_class, card_class)
-		elif c.type == ComponentType.cost:
-			cdata = ComponentData(text=str(card.cost))
-		elif c.type == ComponentType.health:
-			health = str(card.health)
-			if card.type == CardType.WEAPON:
-				health = str(card.durability)
-			cdata = ComponentData(text=health)
-		elif c.type == ComponentType.attack:
-			cdata = ComponentData(text=str(card.atk))
-		elif c.type == ComponentType.race and card.race.visible:
-			cdata = ComponentData(text=get_localized_name(card.race, locale.name))
-		elif c.type == ComponentType.portrait:
-			cdata = ComponentData(None, None, card.id + ".png")
-		elif c.type == ComponentType.base:
-			cdata = ComponentData()
-		elif c.type == ComponentType.description:
-			cdata = ComponentData(text=clean_description_text(card.description, locale))
-		elif c.type == ComponentType.custom:
-			cdata = ComponentData(
-				obj={
-					"card": card,
-					"dir": theme_dir,
-					"premium": premium,
-					"cardtype": card_type
-				}
-			)
-		elif c.type == ComponentType.unknown:
-			cdata = ComponentData()
-		# render any component matched
-		if cdata:
-			render_component(ctx, art_dir, theme_dir, loc_code, c, cdata)
-			rendered_comps += 1
-	# save the image to file if any components have been rendered
-	if rendered_comps > 0:
-		surface.flush()
-		filename = "{}{}.png".format(card.id, PREM_SUFFIX if premium else "")
-		surface.write_to_png(os.path.join(out_dir, filename))
+def warm_shared_state(cards, variants, loc, themes):
+	"""Load what the worker processes share, before they are forked."""
+	import neferset.custom
+	for theme in themes:
+		theme.decode_assets()
+		theme.warm_surfaces()
+	for card in cards:
+		if card.description:
+			clean_description_text(card.description, loc)
+		for theme in themes:
+			for prem in variants:
+				card_type, card_class = fix_card_props(card, prem)
+				for c in theme.components(card_type) or []:
+					if c.type == ComponentType.custom and c.custom:
+						cdata = component_data(
+							c, card, loc, prem, card_type, card_class, theme.dir)
+						neferset.custom.prepare(c, cdata.obj)
+
+
+def create_sink(output, out_dir, sheet_size=0, compression="store", dedup=False):
+	"""Create the output sink that rendered cards are written to."""
+	if output == "files":
+		sink = FileSink(out_dir)
+	elif output == "atlas":
+		sink = AtlasSink(out_dir, sheet_size, sheet_size)
+	elif output in ("zip", "tar"):
+		path = os.path.join(out_dir, "{}.{}".format(ARCHIVE_NAME, output))
+		sink = ArchiveSink(path, output, compression)
+	else:
+		raise ValueError("Unknown output type '{}'".format(output))
+	return DedupSink(sink, out_dir) if dedup else sink
 
 
 def generate(
 		art_dir=ART_DIR, out_dir=OUT_DIR, only=None, locale="enUS",
 		style="default", premium=False, fonts=None, collectible=False,
-		card_set=None, width=0):
+		card_set=None, width=0, art_store=None, output="files",
+		sheet_size=4096, watch=False, query=None, shard=None, bundle=None,
+		compression="store", cull=False, workers=1, quality="normal",
+		dedup=False, derivatives=None, max_tasks=0, max_rss=0,
+		skip_missing=False, metrics=None, metrics_interval=10):
 	"""Main card generation function that defines options and called by Fire.
 
 	-- art_dir	location of the card artwork files
 	-- out_dir	location to save the generate cards
 	-- only		specify a single card id or comma separated list of ids
 	-- locale	the locale the generated cards should be in
-	-- style	the HearthForge style/theme to use
+	-- style	the HearthForge style/theme to use, or comma separated styles
+				to render each card in, saved in a dir per style
 	-- premium	flag to include premium card images (if supported by theme)
 	-- fonts	override the fonts, semi-colon separated 'old=new' pairs
 	-- collectible	only generate collectible cards
 	-- card_set		generate all cards from a set (currently must be enum names)
 	-- width	set the output width of the card image
+	-- art_store	use pre-decoded artwork from this dir (see build_art_store)
+	-- skip_missing	don't render the cards without portrait art, the missing
+				art and theme files are always listed before rendering
+	-- derivatives	use artwork pre-resized for the style and width from this
+				dir (see build_derivatives), before the art store
+	-- output	how to save the cards, 'files', 'atlas' sprite sheets or a
+				'zip' or 'tar' archive
+	-- sheet_size	the width and height of each atlas sheet
+	-- compression	archive compression, 'store' (default) or for zip 'deflate',
+				'bzip2', 'lzma' and for tar 'gz', 'bz2', 'xz'
+	-- watch	keep running, re-rendering the cards affected by file changes
+	-- query	select cards by expression, e.g. 'set=NAXX and cost>=7'
+	-- shard	render only shard 'i/N' (i from 0) of the selected cards
+	-- bundle	use a compiled theme bundle (see compile_theme) not the style
+	-- cull		skip components always hidden by opaque layers above them
+	-- workers	the number of worker processes to render with, they are
+				forked once the shared caches are warm
+	-- quality	'draft', 'normal' or 'release' render settings
+	-- max_tasks	replace a worker process after it renders this many cards,
+				a single worker is forked for this when workers is 1
+	-- max_rss	replace a worker process once its RSS is over this many MB
+	-- dedup	store identical cards once, linked where the output allows,
+				the names and content hashes are saved in dedup.json
+	-- metrics	write run metrics to this JSON lines file and a Prometheus
+				textfile next to it (.prom), every metrics_interval seconds
 	"""
-	import time
 	start = time.perf_counter()
+	neferset.quality.set_quality(quality)
 	# set locale formats
 	loc = locale_converter(locale)
 	loc_code = locale_as_code(loc)
 	# load cards
-	filtered = only if isinstance(only, tuple) else [only]
-	cards = load_cards(locale, filtered, card_set_converter(card_set), collectible)
-	print("Generating {} cards".format(len(cards)))
-	# load theme data, from hearthforge submodule
-	theme_dir = os.path.join(ASSET_DIR, style)
-	if not os.path.isdir(theme_dir):
-		raise FileNotFoundError("Asset dir not found ({})".format(theme_dir))
-	with open(os.path.join(theme_dir, THEME_JSON)) as f:
-		theme_data = json.load(f)
-	# create a font replacer map ( e.g. "Arial=Times;OpenSans=Roboto")
-	font_map = dict(f.split("=") for f in fonts.split(";")) if fonts else None
-	# render cards, the standard card first then the premium if required
-	for c in cards:
-		render(c, loc, loc_code, False, theme_data, theme_dir, art_dir, out_dir, font_map, width)
-		if premium:
-			render(c, loc, loc_code, True, theme_data, theme_dir, art_dir, out_dir, font_map, width)
-	print("Time: {}s".format(time.perf_counter() - start))
+	filtered = as_list(only)
+	# listed, the shards, the missing files report and the workers' order
+	# need the whole selection before rendering starts
+	cards = list(load_cards(
+		locale, filtered, card_set_converter(card_set), collectible, query))
+	total = len(cards)
+	if shard:
+		shard_index, shard_count = parse_shard(shard)
+		cards = assign_shards(
+			cards, shard_count, lambda c: render_cost(c, premium, locale))[shard_index]
+		print("Shard {}/{}: {} of {} cards".format(
+			shard_index, shard_count, len(cards), total))
+	styles = as_list(style)
+	if len(styles) > 1 and (watch or bundle):
+		raise ValueError("Watch mode and bundles only support a single style")
+	if watch and (output != "files" or dedup):
+		raise ValueError("Watch mode only supports 'files' output, without dedup")
+	print("Generating {} cards in {}".format(len(cards), ", ".join(styles)))
+	# the card data, description text and portraits are shared by the styles
+	targets = []
+	for name in styles:
+		theme = load_theme(name, parse_font_map(fonts), bundle, cull)
+		warm_fonts(theme, loc)
+		style_dir = out_dir
+		prefix = ""
+		if len(styles) > 1:
+			style_dir = os.path.join(out_dir, name)
+			prefix = name + "/"
+			os.makedirs(style_dir, exist_ok=True)
+		targets.append(
+			(prefix, theme, create_sink(output, style_dir, sheet_size, compression, dedup)))
+	themes = [t for _, t, _ in targets]
+	sinks = [s for _, _, s in targets]
+	# reuse the same surfaces for every card, rather than allocating per render
+	pool = SurfacePool()
+	store = open_art(art_dir, art_store, derivatives, len(styles) > 1)
+	# stop cleanly when terminated, so the output is closed properly
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+
+	outputs = {}
+	skipped = set()
+	failures = set()
+
+	variants = (False, True) if premium else (False,)
+	# list the art and theme files once, rather than checking each as drawn
+	use_index(AssetIndex([art_dir] + [t.dir for t in themes]))
+	missing_art, missing_files = preflight(cards, themes, art_dir, loc, variants, store)
+	report_missing("art", missing_art)
+	report_missing("theme files", missing_files)
+	selected = cards
+	if skip_missing and missing_art:
+		skip = set().union(*missing_art.values())
+		selected = [c for c in cards if c.id not in skip]
+		skipped.update(skip)
+		neferset.metrics.outcome("skipped", "missing art", len(skip))
+		print("Skipping {} cards without art".format(len(skip)))
+	stats = WorkerStats()
+	# with a task or memory limit a single worker is forked too, so it can
+	# be replaced
+	forked = workers > 1 or max_tasks or max_rss
+	if forked:
+		warm_shared_state(selected, variants, loc, themes)
+	run = None
+	if metrics:
+		labels = {"style": ",".join(styles), "locale": locale}
+		if shard:
+			labels["shard"] = shard
+		run = RunMetrics(metrics, metrics_interval, labels)
+	# counted before forking, so the workers start from zero
+	warmed = neferset.metrics.take()
+	if run:
+		run.add(warmed)
+	# predicted render times, from previous runs or the estimated cost
+	timings = CardTimings(TIMINGS_JSON)
+	predicted, calibrated = timings.predict(selected, locale, premium)
+
+	def render_single(card):
+		card_start = time.perf_counter()
+		names, failed = render_variants(
+			card, variants, loc, loc_code, targets, art_dir, width, pool, store)
+		seconds = time.perf_counter() - card_start
+		stats.update(os.getpid(), memory_usage())
+		return (card, names, failed, [], seconds, neferset.metrics.take())
+
+	def render_cards(selection):
+		if forked:
+			# slowest first, so the cheap cards fill in the gaps at the end
+			selection = sorted(selection, key=lambda c: -predicted.get(c.id, 0))
+			# the workers send back encoded cards, except for plain files
+			state = {
+				"cards": selection, "variants": variants, "loc": loc,
+				"loc_code": loc_code, "art_dir": art_dir, "width": width,
+				"pool": pool, "store": store,
+				"targets": [(p, t, s if isinstance(s, FileSink) else EncodedSink())
+					for p, t, s in targets]
+			}
+			results = ((state["cards"][i], names, failed, encoded, seconds, counts)
+				for i, names, failed, encoded, seconds, counts in fork_map(
+					render_task, state, range(len(state["cards"])), max(workers, 1),
+					stats, max_tasks, int(max_rss * 1048576)))
+		else:
+			# not sorted, one process takes as long in any order, so the
+			# cards are rendered in the order they were selected
+			results = (render_single(c) for c in selection)
+		for card, names, failed, encoded, seconds, counts in results:
+			write_start = time.perf_counter()
+			for i, e in encoded:
+				sinks[i].write_png(*e)
+			if encoded:
+				neferset.metrics.stage("write", time.perf_counter() - write_start)
+			for name in names:
+				outputs[name] = card.id
+			# failed cards are not skipped, merge-shards reports them
+			if failed:
+				failures.add(card.id)
+			elif not names:
+				skipped.add(card.id)
+			if names:
+				timings.record(card.id, locale, premium, seconds)
+			if run:
+				run.record(len(names), seconds, counts)
+				run.add(neferset.metrics.take())
+
+	def render_changed(selection):
+		render_cards(selection)
+		# saved each cycle, a watch only ends when it is interrupted
+		timings.save()
+
+	try:
+		render_start = time.perf_counter()
+		render_cards(selected)
+		print("Time: {}s".format(time.perf_counter() - start))
+		print("Makespan: predicted {:.2f}s{}, actual {:.2f}s".format(
+			makespan(sorted(predicted.values(), reverse=True), workers),
+			"" if calibrated else " (uncalibrated)",
+			time.perf_counter() - render_start))
+		timings.save()
+		if watch:
+			# caches stay warm between changes, only affected cards are rendered
+			watch_cards(
+				cards,
+				lambda: list(load_cards(
+					locale, filtered, card_set_converter(card_set), collectible, query)),
+				render_changed, themes[0], art_dir, loc, premium, store)
+	finally:
+		for sink in sinks:
+			sink.close()
+		if run:
+			run.add(neferset.metrics.take())
+			run.close()
+	if shard:
+		path = write_manifest(
+			out_dir, shard_index, shard_count, total, [c.id for c in cards],
+			outputs, skipped, failures)
+		print("Manifest: {}".format(path))
+	pool.clear()
+	if store:
+		store.clear()
+	for prefix, theme, sink in targets:
+		print("Output: {}{}".format(prefix, sink))
+	# the hits of worker processes are not sent back
+	if isinstance(store, DerivativeCache) and workers <= 1:
+		print("Derivatives: {}".format(store))
+	print("Surfaces: {}".format(pool))
+	for line in stats.report():
+		print(line)
+	if run:
+		for line in run.report():
+			print(line)
+
+
+def open_art(art_dir, art_store=None, derivatives=None, shared=False):
+	"""Open the pre-decoded and pre-resized artwork, missing entries are
+	decoded from the png when drawn, or once per card when shared by several
+	styles."""
+	store = ArtStore(art_store, art_dir) if art_store else None
+	if shared:
+		store = RecentArt(art_dir, store)
+	if derivatives:
+		store = DerivativeCache(derivatives, art_dir, store)
+	return store
+
+
+def portrait_sizes(theme, widths):
+	"""The pixel sizes portraits are drawn at, for each output width."""
+	sizes = set()
+	for width in widths:
+		scale = output_scale(theme.width, width)
+		for components in theme.card_types.values():
+			for c in components:
+				if c.type == ComponentType.portrait and c.image:
+					sizes.add((
+						int(round(c.image.width * scale)),
+						int(round(c.image.height * scale))))
+	return sorted(sizes)
+
+
+def derivative_task(state, name):
+	entry, built = build_derivatives(
+		os.path.join(state["art_dir"], name), state["cache_dir"], state["sizes"],
+		state["index"].get(name))
+	return (name, entry, built)
+
+
+def build_derivatives_cache(
+		art_dir=ART_DIR, cache_dir=DERIVATIVE_DIR, style="default", width=0,
+		bundle=None, workers=1):
+	"""Resize the card artwork to the portrait sizes of a style, for use
+	with the generate derivatives option.
+
+	-- art_dir	location of the card artwork files
+	-- cache_dir	location to save the resized artwork
+	-- width	comma separated output widths to build the sizes for
+	-- workers	the number of processes to resize with
+	-- style, bundle	as in generate
+	"""
+	start = time.perf_counter()
+	theme = load_theme(style, None, bundle)
+	sizes = portrait_sizes(theme, [int(w) for w in as_list(width)])
+	os.makedirs(cache_dir, exist_ok=True)
+	names = sorted(n for n in os.listdir(art_dir) if n.lower().endswith(".png"))
+	state = {
+		"art_dir": art_dir, "cache_dir": cache_dir, "sizes": sizes,
+		"index": load_index(cache_dir)
+	}
+	if workers > 1:
+		results = fork_map(derivative_task, state, names, workers)
+	else:
+		results = (derivative_task(state, n) for n in names)
+	index, built = {}, 0
+	for name, entry, count in results:
+		index[name] = entry
+		built += count
+	save_index(cache_dir, index)
+	print("Derivatives: {} built for {} images at {} in {:.2f}s".format(
+		built, len(names), ", ".join("{}x{}".format(*s) for s in sizes),
+		time.perf_counter() - start))
+
+
+def stream_task(state, selection):
+	"""Render one variant of a card for render_stream, errors are returned."""
+	card_id, premium = selection
+	try:
+		if card_id not in state["db"]:
+			raise KeyError("Unknown card id {}".format(card_id))
+		sink = EncodedSink()
+		name = render(
+			state["db"][card_id], state["loc"], state["loc_code"], premium,
+			state["theme"], state["art_dir"], sink, state["width"],
+			state["pool"], state["store"])
+		if not name:
+			raise ValueError("Nothing rendered for {}".format(card_id))
+		result = sink.take()[0][1]
+	except Exception as e:
+		result = e
+	return (card_id, variant_name(premium), result)
+
+
+def render_stream(
+		selection, locale="enUS", style="default", premium=False,
+		art_dir=ART_DIR, width=0, fonts=None, bundle=None, art_store=None,
+		derivatives=None, workers=1, quality="normal"):
+	"""Render cards as they are requested, for use from other programs.
+
+	selection is an iterable of card ids, or (card id, premium) tuples, it
+	is consumed as renders finish, so it can be fed while rendering. Yields
+	a tuple of (card id, variant, result) per render, in completion order,
+	the result is the PNG data or the exception that stopped the render.
+	With workers > 1 the renders run in forked processes and at most one
+	card per worker is in flight. The options are as in generate.
+	"""
+	neferset.quality.set_quality(quality)
+	loc = locale_converter(locale)
+	theme = load_theme(style, parse_font_map(fonts), bundle)
+	warm_fonts(theme, loc)
+	variants = (False, True) if premium else (False,)
+
+	def requests():
+		for item in selection:
+			if isinstance(item, (tuple, list)):
+				yield tuple(item)
+			else:
+				for prem in variants:
+					yield (item, prem)
+
+	state = {
+		"db": load_db(DB_XML, locale), "loc": loc, "loc_code": locale_as_code(loc),
+		"theme": theme, "art_dir": art_dir, "width": width, "pool": SurfacePool(),
+		"store": open_art(art_dir, art_store, derivatives)
+	}
+	if workers > 1:
+		theme.decode_assets()
+		theme.warm_surfaces()
+		results = fork_map(stream_task, state, requests(), workers)
+	else:
+		results = (stream_task(state, r) for r in requests())
+	try:
+		yield from results
+	finally:
+		results.close()
+		state["pool"].clear()
+		if state["store"]:
+			state["store"].clear()
+
+
+def prepare_plans(
+		out="plans.jsonl", only=None, locale="enUS", style="default",
+		premium=False, collectible=False, card_set=None, width=0, query=None,
+		bundle=None):
+	"""Save the render plans of the selected cards, to be drawn by the
+	rasterize command, which doesn't need the card data. Theme files are
+	relative to the style, the rasterizer finds them in its asset dir.
+
+	-- out		the JSON lines plans file to save, '-' for stdout
+	-- only, locale, style, premium, collectible, card_set, width, query,
+		bundle	as in generate
+	"""
+	start = time.perf_counter()
+	f = sys.stdout if out == "-" else open(out, "w")
+	count, card_count = 0, 0
+	# keep messages out of the plans when they are written to stdout
+	with contextlib.redirect_stdout(sys.stderr):
+		loc = locale_converter(locale)
+		loc_code = locale_as_code(loc)
+		cards = load_cards(
+			locale, as_list(only), card_set_converter(card_set), collectible, query)
+		styles = as_list(style)
+		if len(styles) > 1 and bundle:
+			raise ValueError("Bundles only support a single style")
+		themes = [load_theme(name, None, bundle) for name in styles]
+		variants = (False, True) if premium else (False,)
+		try:
+			for card in cards:
+				card_count += 1
+				for theme in themes:
+					for prem in variants:
+						plan = plan_card(card, loc, loc_code, prem, theme, width)
+						if not plan or not plan["layers"]:
+							continue
+						# a dir per style, as in generate
+						if len(themes) > 1:
+							plan["name"] = plan["style"] + "/" + plan["name"]
+						f.write(json.dumps(plan, sort_keys=True) + "\n")
+						count += 1
+		finally:
+			if f is not sys.stdout:
+				f.close()
+		print("Prepared {} plans for {} cards in {:.2f}s".format(
+			count, card_count, time.perf_counter() - start))
+
+
+def build_art_store(art_dir=ART_DIR, store_dir=ART_STORE_DIR):
+	"""Pre-decode the card artwork for use with the generate art_store option.
+
+	-- art_dir	location of the card artwork files
+	-- store_dir	location to save the decoded artwork
+	"""
+	built, skipped = build_store(art_dir, store_dir)
+	print("Art store: {} built, {} up to date".format(built, skipped))
+
+
+def compile_theme_bundle(style="default", out=None, decode=False, cull=True):
+	"""Validate a theme and save it as a bundle for the generate bundle option.
+
+	-- style	the HearthForge style/theme to compile
+	-- out		the bundle file to save, defaults to the .cache dir
+	-- decode	include the pre-decoded image assets in the bundle
+	-- cull		remove components always hidden by opaque layers above them
+	"""
+	start = time.perf_counter()
+	theme = compile_theme(os.path.join(ASSET_DIR, style), decode=decode, cull=cull)
+	for c in theme.culling_report():
+		print("Culled: {}".format(c))
+	out = out or BUNDLE_FMT.format(style)
+	save_bundle(theme, out)
+	print("Compiled {} to {} in {:.2f}s".format(theme, out, time.perf_counter() - start))
+
+
+def merge_shards(*paths, out=None):
+	"""Check the shard manifests of a run cover every card exactly once.
+
+	-- paths	manifest files or the dirs containing them
+	-- out		save the merged manifest to this file
+	"""
+	files = find_manifests(paths)
+	merged, problems = merge_manifests(files)
+	print("{} manifests, {} outputs for {} cards".format(
+		len(files), len(merged.get("outputs", {})), merged.get("total", 0)))
+	for p in problems:
+		print(p)
+	if out:
+		with open(out, "w") as f:
+			json.dump(merged, f, indent=1)
+	if problems:
+		sys.exit(1)
+
+
+def enqueue(
+		store=QUEUE_DB, only=None, locale="enUS", premium=False, width=0,
+		collectible=False, card_set=None, query=None):
+	"""Add render jobs to a queue for worker processes.
+
+	-- store	the job queue database file
+	-- locale	comma separated locales to render each card in
+	-- width	comma separated output widths to render each card at
+	-- only, premium, collectible, card_set, query	as in generate
+	"""
+	locales = as_list(locale)
+	widths = as_list(width)
+	cards = load_cards(
+		locales[0], as_list(only), card_set_converter(card_set), collectible, query)
+	variants = (False, True) if premium else (False,)
+	queue = JobQueue(store)
+	card_count = 0
+
+	def jobs():
+		nonlocal card_count
+		for card in cards:
+			card_count += 1
+			for l in locales:
+				for p in variants:
+					for w in widths:
+						yield (card.id, l, p, int(w))
+
+	added = queue.enqueue(jobs())
+	print("Queued {} jobs ({} cards), {} unfinished".format(
+		added, card_count, queue.unfinished()))
+	queue.close()
+
+
+def job_task(state, job):
+	"""Render a queued job, in the worker or a process forked from it, the
+	error (if any) is returned as a string."""
+	start = time.perf_counter()
+	output, error = None, None
+	try:
+		loc = locale_converter(job.locale)
+		card = state["dbs"][job.locale][job.card_id]
+		key = (job.locale, job.width)
+		if key not in state["sinks"]:
+			job_dir = os.path.join(state["out_dir"], job.locale)
+			if job.width:
+				job_dir = os.path.join(job_dir, str(job.width))
+			os.makedirs(job_dir, exist_ok=True)
+			state["sinks"][key] = FileSink(job_dir)
+		output = render(
+			card, loc, locale_as_code(loc), job.premium, state["theme"],
+			state["art_dir"], state["sinks"][key], job.width, state["pool"],
+			state["store"])
+	except Exception as e:
+		error = "{}: {}".format(type(e).__name__, e)
+		neferset.metrics.outcome("failed", type(e).__name__)
+	return (job, output, error, time.perf_counter() - start, neferset.metrics.take())
+
+
+def worker(
+		store=QUEUE_DB, art_dir=ART_DIR, out_dir=OUT_DIR, style="default",
+		fonts=None, art_store=None, lease=300, batch=4, wait=True, bundle=None,
+		quality="normal", derivatives=None, metrics=None, metrics_interval=10,
+		max_tasks=0, max_rss=0):
+	"""Render jobs from a queue until it is finished.
+
+	Outputs are saved in a dir per locale, and per width when it is set.
+
+	-- store	the job queue database file
+	-- lease	seconds a claimed job is held for, it is renewed while the
+				worker runs, a job is retried once the lease of a worker that
+				stopped expires
+	-- batch	the number of jobs to claim at a time
+	-- wait		keep polling while other workers have jobs leased
+	-- metrics	write run metrics as in generate, use a file per worker
+	-- max_tasks, max_rss	render in a forked process, replaced by a fresh
+				fork after this many jobs or once its RSS is over this many MB
+	-- art_dir, out_dir, style, fonts, art_store, bundle, quality, derivatives
+				as in generate
+	"""
+	neferset.quality.set_quality(quality)
+	queue = JobQueue(store)
+	name = worker_name()
+	theme = load_theme(style, parse_font_map(fonts), bundle)
+	state = {
+		"theme": theme, "art_dir": art_dir, "out_dir": out_dir,
+		"pool": SurfacePool(), "store": open_art(art_dir, art_store, derivatives),
+		"dbs": {}, "sinks": {}
+	}
+	stats = WorkerStats()
+	rendered, failed = 0, 0
+	run = RunMetrics(metrics, metrics_interval, {"worker": name}) if metrics else None
+	print("Worker {} started".format(name))
+
+	def claimed():
+		while True:
+			jobs = queue.claim(name, lease, batch)
+			if not jobs:
+				queue.expire_exhausted()
+				if not wait or queue.unfinished() == 0:
+					return
+				time.sleep(min(lease, 10))
+				continue
+			for job in jobs:
+				# loaded here rather than by the task, so replaced forks share it
+				if job.locale not in state["dbs"]:
+					state["dbs"][job.locale] = load_db(DB_XML, job.locale)
+					warm_fonts(theme, locale_converter(job.locale))
+				yield job
+
+	def render_single(job):
+		result = job_task(state, job)
+		stats.update(os.getpid(), memory_usage())
+		return result
+
+	if max_tasks or max_rss:
+		theme.decode_assets()
+		theme.warm_surfaces()
+		results = fork_map(
+			job_task, state, claimed(), 1, stats, max_tasks, int(max_rss * 1048576))
+	else:
+		results = (render_single(j) for j in claimed())
+	# keeps the claimed jobs leased however long they take to render
+	heartbeat = LeaseHeartbeat(store, name, lease)
+	try:
+		for job, output, error, seconds, counts in results:
+			if error:
+				print("{} failed: {}".format(job, error))
+				queue.fail(job, name, error)
+				failed += 1
+			else:
+				queue.complete(job, name, output)
+				rendered += 1
+			if run:
+				run.record(1 if output else 0, seconds, counts)
+	finally:
+		heartbeat.stop()
+	queue.close()
+	state["pool"].clear()
+	print("Worker {} finished: {} rendered, {} failed".format(name, rendered, failed))
+	for line in stats.report():
+		print(line)
+	if run:
+		run.close()
+		for line in run.report():
+			print(line)
+
+
+def status(store=QUEUE_DB, window=300):
+	"""Show the progress of a job queue.
+
+	-- store	the job queue database file
+	-- window	seconds of recent jobs used for throughput and ETA
+	"""
+	queue = JobQueue(store)
+	counts = queue.counts()
+	total = sum(counts.values())
+	print(", ".join("{} {}".format(v, k) for k, v in counts.items()))
+	if total:
+		print("{:.1f}% complete".format(100 * (counts["done"] + counts["failed"]) / total))
+	rate = queue.throughput(window)
+	unfinished = queue.unfinished()
+	if rate > 0:
+		print("{:.2f} jobs/s, ETA {:.0f}s".format(rate, unfinished / rate))
+	elif unfinished:
+		print("No jobs finished in the last {}s".format(window))
+	for card_id, locale, premium, width, error in queue.failures():
+		print("Failed: {} {} {}{} ({})".format(
+			card_id, locale, width, " premium" if premium else "", error))
+	queue.close()
+
+
+COMMANDS = {
+	"generate": generate,
+	"prepare": prepare_plans,
+	"rasterize": rasterize_plans,
+	"build_art_store": build_art_store,
+	"build_derivatives": build_derivatives_cache,
+	"compile_theme": compile_theme_bundle,
+	"merge_shards": merge_shards,
+	"enqueue": enqueue,
+	"worker": worker,
+	"status": status,
+}
 
 
 if __name__ == "__main__":
-	fire.Fire(generate)
+	import fire
+	# run a named command, otherwise default to generate
+	if len(sys.argv) > 1 and sys.argv[1].replace("-", "_") in COMMANDS:
+		command = COMMANDS[sys.argv.pop(1).replace("-", "_")]
+	else:
+		command = generate
+	fire.Fire(command)
@@ -0,0 +1,277 @@
+import os
+import os.path
+import mmap
+import struct
+from collections import OrderedDict
+import cairo
+from .assets import exists
+
+MAGIC = b"NFRA"
+# magic, source mtime (ns), source size, format, width, height, stride
+HEADER = struct.Struct("<4sqqiiii")
+HEADER_SIZE = 64 # keep the pixel data aligned for cairo
+STORE_EXT = ".argb"
+# entries kept mapped per store, each mapping holds a file descriptor open
+KEEP_MAPPED = 256
+
+
+def store_name(name):
+	"""The store file name for an art file name (e.g. 'EX1_001.png')."""
+	return os.path.splitext(name)[0] + STORE_EXT
+
+
+def build_entry(src_path, dest_path, force=False):
+	"""Decode a PNG and write it as raw premultiplied ARGB in cairo's stride.
+
+	Returns False when the entry is already up to date with the source.
+	force -- rebuild even when the header is current, e.g. a truncated entry
+	"""
+	stat = os.stat(src_path)
+	if not force and entry_current(dest_path, stat):
+		return False
+	img = cairo.ImageSurface.create_from_png(src_path)
+	write_entry(img, dest_path, stat)
+	img.finish()
+	return True
+
+
+def entry_current(path, stat):
+	"""Whether the entry at path was built from a source with this stat."""
+	try:
+		with open(path, "rb") as f:
+			header = f.read(HEADER.size)
+	except FileNotFoundError:
+		return False
+	if len(header) < HEADER.size:
+		return False
+	magic, mtime, size = HEADER.unpack(header)[:3]
+	return magic == MAGIC and mtime == stat.st_mtime_ns and size == stat.st_size
+
+
+def write_entry(img, dest_path, stat):
+	"""Write a surface as a store entry, stamped with its source file stat."""
+	img.flush()
+	header = HEADER.pack(
+		MAGIC, stat.st_mtime_ns, stat.st_size, img.get_format(),
+		img.get_width(), img.get_height(), img.get_stride())
+	# write to a temp file first, so readers never map a partial entry
+	# per process, several workers may rebuild the same stale entry
+	tmp_path = "{}.{}.tmp".format(dest_path, os.getpid())
+	with open(tmp_path, "wb") as f:
+		f.write(header.ljust(HEADER_SIZE, b"\0"))
+		f.write(img.get_data())
+	os.replace(tmp_path, dest_path)
+
+
+def map_entry(path, stat=None):
+	"""Memory map a store entry as a surface, returns the surface and its
+	mapping (see unmap), None if it is missing, invalid or (when the source
+	file stat is given) out of date."""
+	try:
+		f = open(path, "rb")
+	except FileNotFoundError:
+		return None
+	with f:
+		size = os.fstat(f.fileno()).st_size
+		if size < HEADER_SIZE:
+			print("Invalid art store entry ({})".format(path))
+			return None
+		mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+	magic, mtime, src_size, fmt, width, height, stride = HEADER.unpack_from(mapped)
+	if magic != MAGIC or len(mapped) < HEADER_SIZE + stride * height:
+		print("Invalid art store entry ({})".format(path))
+		mapped.close()
+		return None
+	if stat and (mtime != stat.st_mtime_ns or src_size != stat.st_size):
+		mapped.close()
+		return None
+	data = memoryview(mapped)[HEADER_SIZE:HEADER_SIZE + stride * height]
+	try:
+		surface = cairo.ImageSurface.create_for_data(
+			data, cairo.Format(fmt), width, height, stride)
+	except (ValueError, cairo.Error):
+		print("Invalid art store entry ({})".format(path))
+		data.release()
+		mapped.close()
+		return None
+	return (surface, mapped)
+
+
+def unmap(entry):
+	"""Finish a mapped surface and close its mapping, and so its file."""
+	surface, mapped = entry
+	surface.finish()
+	del surface, entry
+	try:
+		mapped.close()
+	except BufferError:
+		# the surface is still referenced, it is closed once that is freed
+		pass
+
+
+class MappedEntries:
+	"""The most recently used entries of a store, kept mapped.
+
+	Each mapping holds a file descriptor open, so rather than keeping every
+	entry of a run mapped (past the open file limit) the least recently used
+	are unmapped as more are added. Missing entries are kept as None.
+	"""
+	def __init__(self, keep=KEEP_MAPPED):
+		self.keep = keep
+		self._entries = OrderedDict()
+
+	def __contains__(self, key):
+		return key in self._entries
+
+	def get(self, key):
+		self._entries.move_to_end(key)
+		entry = self._entries[key]
+		return entry[0] if entry else None
+
+	def add(self, key, entry):
+		"""Keep the result of map_entry for key, returns its surface."""
+		self.discard(key)
+		self._entries[key] = entry
+		if len(self._entries) > self.keep:
+			old = self._entries.popitem(last=False)[1]
+			if old:
+				unmap(old)
+		return entry[0] if entry else None
+
+	def discard(self, key):
+		entry = self._entries.pop(key, None)
+		if entry:
+			unmap(entry)
+
+	def clear(self):
+		entries, self._entries = self._entries, OrderedDict()
+		while entries:
+			entry = entries.popitem()[1]
+			if entry:
+				unmap(entry)
+
+
+def build_store(art_dir, store_dir):
+	"""Pre-decode every PNG in the art dir into the store dir.
+
+	Returns a tuple of (built, skipped) counts.
+	"""
+	if not os.path.isdir(store_dir):
+		os.makedirs(store_dir)
+	built, skipped = 0, 0
+	for name in sorted(os.listdir(art_dir)):
+		if not name.lower().endswith(".png"):
+			continue
+		src = os.path.join(art_dir, name)
+		if build_entry(src, os.path.join(store_dir, store_name(name))):
+			built += 1
+		else:
+			skipped += 1
+	return (built, skipped)
+
+
+class ArtStore:
+	"""Read only access to a store of pre-decoded art.
+
+	Entries are memory mapped copy-on-write and wrapped as cairo surfaces
+	without copying, so processes using the same store share the page cache.
+	"""
+	def __init__(self, store_dir, art_dir=None):
+		if not os.path.isdir(store_dir):
+			raise FileNotFoundError("Art store not found ({})".format(store_dir))
+		self.store_dir = store_dir
+		self.art_dir = art_dir
+		self._mapped = MappedEntries()
+
+	def get(self, name, size=None):
+		"""Get the surface for an art file name, None if it is not stored.
+
+		size is the size the art is drawn at, entries are always full size.
+		With an art dir, an entry that is out of date with its source or
+		invalid is rebuilt, a source that is not there uses the entry as is.
+		"""
+		if name in self._mapped:
+			return self._mapped.get(name)
+		path = os.path.join(self.store_dir, store_name(name))
+		src = os.path.join(self.art_dir, name) if self.art_dir else None
+		try:
+			stat = os.stat(src) if src else None
+		except FileNotFoundError:
+			stat = None
+		entry = map_entry(path, stat)
+		if entry is None and stat and name.lower().endswith(".png"):
+			try:
+				build_entry(src, path, True)
+			except (OSError, cairo.Error) as e:
+				print("Could not rebuild art store entry ({}): {}".format(path, e))
+			else:
+				entry = map_entry(path, stat)
+		return self._mapped.add(name, entry)
+
+	def has(self, name):
+		"""Whether there is an entry for an art file name, without mapping it."""
+		return os.path.isfile(os.path.join(self.store_dir, store_name(name)))
+
+	def discard(self, name):
+		"""Unmap the surface for name, e.g. after the entry is rebuilt."""
+		self._mapped.discard(name)
+
+	def refresh(self, art_dir, name):
+		"""Rebuild the entry for an art file after it is modified."""
+		src = os.path.join(art_dir, name)
+		if os.path.isfile(src) and name.lower().endswith(".png"):
+			build_entry(src, os.path.join(self.store_dir, store_name(name)))
+		self.discard(name)
+
+	def clear(self):
+		self._mapped.clear()
+
+
+class RecentArt:
+	"""Keep the last few art files decoded, e.g. so a card's portrait is
+	decoded once when it is drawn in several styles.
+
+	Art found in the fallback store (if any) is used as is.
+	"""
+	def __init__(self, art_dir, fallback=None, keep=4):
+		self.art_dir = art_dir
+		self.fallback = fallback
+		self.keep = keep
+		self._surfaces = OrderedDict()
+
+	def get(self, name, size=None):
+		surface = self.fallback.get(name, size) if self.fallback else None
+		if surface:
+			return surface
+		if name in self._surfaces:
+			self._surfaces.move_to_end(name)
+			return self._surfaces[name]
+		path = os.path.join(self.art_dir, name)
+		if not exists(path):
+			return None
+		surface = cairo.ImageSurface.create_from_png(path)
+		self._surfaces[name] = surface
+		if len(self._surfaces) > self.keep:
+			self._surfaces.popitem(last=False)[1].finish()
+		return surface
+
+	def has(self, name):
+		"""Whether the fallback store has name, the art dir is not checked."""
+		return bool(self.fallback and self.fallback.has(name))
+
+	def discard(self, name):
+		surface = self._surfaces.pop(name, None)
+		if surface:
+			surface.finish()
+
+	def refresh(self, art_dir, name):
+		self.discard(name)
+		if self.fallback:
+			self.fallback.refresh(art_dir, name)
+
+	def clear(self):
+		for surface in self._surfaces.values():
+			surface.finish()
+		self._surfaces = OrderedDict()
+		if self.fallback:
+			self.fallback.clear()
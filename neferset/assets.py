@@ -0,0 +1,59 @@
+import os
+import os.path
+
+# the index used by exists, see use_index
+INDEX = None
+
+
+class AssetIndex:
+	"""The files in a set of directories, scanned once.
+
+	Used in place of a stat call per file when drawing, which adds up on
+	network mounted art and theme directories.
+	"""
+	def __init__(self, dirs):
+		self.dirs = [os.path.normpath(d) for d in dirs]
+		self.files = set()
+		for d in self.dirs:
+			if os.path.isdir(d):
+				self._scan(d)
+
+	def _scan(self, path):
+		for entry in os.scandir(path):
+			if entry.is_dir():
+				self._scan(entry.path)
+			elif entry.is_file():
+				self.files.add(os.path.normpath(entry.path))
+
+	def covers(self, path):
+		"""Check if a path is in one of the indexed directories."""
+		path = os.path.normpath(path)
+		return any(path.startswith(d + os.sep) for d in self.dirs)
+
+	def exists(self, path):
+		return os.path.normpath(path) in self.files
+
+	def refresh(self, paths):
+		"""Update the index for paths that were added, modified or removed."""
+		for path in paths:
+			path = os.path.normpath(path)
+			if os.path.isfile(path):
+				self.files.add(path)
+			else:
+				self.files.discard(path)
+
+	def __len__(self):
+		return len(self.files)
+
+
+def use_index(index):
+	"""Answer exists from index for the directories it covers, None to stop."""
+	global INDEX
+	INDEX = index
+
+
+def exists(path):
+	"""Check if a file exists, from the index when it covers the path."""
+	if INDEX and INDEX.covers(path):
+		return INDEX.exists(path)
+	return os.path.isfile(path)
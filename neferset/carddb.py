@@ -0,0 +1,44 @@
+import os
+import os.path
+import pickle
+
+CACHE_DIR = ".cache"
+CACHE_FMT = "carddb_{}.pickle"
+
+
+def load_db(xml_path, locale, cache_dir=CACHE_DIR):
+	"""Load the card db for a locale, a dict of card id to CardXML.
+
+	Parsing the full card XML dominates startup, so the db is pickled in
+	cache_dir and reused while the XML is unchanged. The XML parser is only
+	imported when the cache can't be used.
+	"""
+	stat = os.stat(xml_path)
+	key = (os.path.abspath(xml_path), stat.st_mtime_ns, stat.st_size)
+	cache_path = os.path.join(cache_dir, CACHE_FMT.format(locale)) if cache_dir else None
+	if cache_path and os.path.isfile(cache_path):
+		try:
+			with open(cache_path, "rb") as f:
+				cached_key, db = pickle.load(f)
+			if cached_key == key:
+				return db
+		except Exception as e:
+			print("Ignoring card db cache ({}): {}".format(cache_path, e))
+	from hearthstone.cardxml import load
+	db, _ = load(xml_path, locale)
+	if cache_path:
+		save_db(cache_path, key, db)
+	return db
+
+
+def save_db(cache_path, key, db):
+	os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+	tmp_path = cache_path + ".tmp"
+	try:
+		with open(tmp_path, "wb") as f:
+			pickle.dump((key, db), f, pickle.HIGHEST_PROTOCOL)
+		os.replace(tmp_path, cache_path)
+	except (pickle.PicklingError, TypeError, AttributeError) as e:
+		print("Card db can't be cached: {}".format(e))
+		if os.path.isfile(tmp_path):
+			os.remove(tmp_path)
@@ -51,6 +51,7 @@ class Image(Region):
 		self.width = data["width"]
 		self.height = data["height"]
 		self.assets = data["assets"]
+		self.paths = {} # resolved, existing, asset files by key
 
 
 class Text(Region):
@@ -84,6 +85,13 @@ class Font:
 class Clip:
 	def __init__(self, data):
 		self.points = data["points"]
+		self.path = None # precompiled cairo path, see drawing.polygon_path
+
+	def __getstate__(self):
+		# cairo paths can't be pickled, they are recreated after loading
+		state = self.__dict__.copy()
+		state["path"] = None
+		return state
 
 
 # TODO use geometry point instead?
@@ -102,13 +110,17 @@ class Curve:
 		self.end = Point(data["end"])
 		self.c1 = Point(data["c1"])
 		self.c2 = Point(data["c2"])
+		# precomputed (arc length table, length) of the curve, by the number
+		# of segments sampled, which depends on the quality preset
+		self.tables = {}
 
 	def __str__(self):
 		return "{} {} {} {}".format(self.start, self.c1, self.c2, self.end)
 
 
 class Component:
-	def __init__(self, data, type, font_map=None):
+	def __init__(self, data, type, font_map=None, name=None):
+		self.name = name
 		self.layer = data["layer"]
 		txt = data.get("text")
 		self.text = Text(txt) if txt else None
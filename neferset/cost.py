@@ -0,0 +1,110 @@
+import os
+import os.path
+import json
+import heapq
+from hearthstone.enums import CardType, Race, CardSet
+
+# relative cost of a description character, dense scripts have more glyphs
+# per word and larger fallback fonts, languages with long words wrap more
+LOCALE_TEXT_WEIGHT = {
+	"zhCN": 2.5, "zhTW": 2.5, "jaJP": 2.0, "koKR": 2.0, "thTH": 1.5,
+	"deDE": 1.1, "ruRU": 1.1, "plPL": 1.1
+}
+# seconds per unit of estimated cost, until timings have been recorded
+DEFAULT_SCALE = 0.05
+
+
+def estimate_cost(card, premium=False, locale=None):
+	"""Estimate the relative time to render a card, a plain spell is ~1.
+
+	Descriptions and curved or outlined text dominate render time, so the
+	estimate counts the text drawn and the optional components.
+	"""
+	cost = 1.0
+	if card.description:
+		cost += len(card.description) / 100 * LOCALE_TEXT_WEIGHT.get(locale, 1.0)
+	if card.type == CardType.MINION:
+		# attack, health and race text
+		cost += 0.3
+		if card.race != Race.INVALID:
+			cost += 0.2
+	elif card.type == CardType.WEAPON:
+		cost += 0.3
+	if card.card_set != CardSet.CORE:
+		# set watermark or icon
+		cost += 0.2
+	if premium:
+		cost *= 1.5
+	return cost
+
+
+def render_cost(card, premium=False, locale=None):
+	"""Estimate the cost of rendering a card, with the premium variant as
+	well as the normal one when premium is set, as generate does."""
+	cost = estimate_cost(card, False, locale)
+	if premium:
+		cost += estimate_cost(card, True, locale)
+	return cost
+
+
+class CardTimings:
+	"""Render times of cards from previous runs, saved as JSON.
+
+	Times are per card, locale and set of variants, smoothed over runs. The
+	cards without a recorded time are predicted from their estimated cost,
+	scaled by the seconds per cost unit of the recorded cards.
+	"""
+	def __init__(self, path):
+		self.path = path
+		self.times = {}
+		if os.path.isfile(path):
+			try:
+				with open(path) as f:
+					self.times = json.load(f)
+			except ValueError:
+				print("Ignoring invalid timings file {}".format(path))
+
+	@staticmethod
+	def key(card_id, locale, premium):
+		return "{}:{}{}".format(card_id, locale, ":premium" if premium else "")
+
+	def get(self, card_id, locale, premium):
+		return self.times.get(self.key(card_id, locale, premium))
+
+	def record(self, card_id, locale, premium, seconds):
+		key = self.key(card_id, locale, premium)
+		old = self.times.get(key)
+		self.times[key] = seconds if old is None else (old + seconds) / 2
+
+	def predict(self, cards, locale, premium):
+		"""Predicted seconds to render each card, a dict by card id, and
+		whether any recorded times were used to calibrate it."""
+		estimates = {}
+		recorded = {}
+		for card in cards:
+			estimates[card.id] = render_cost(card, premium, locale)
+			seconds = self.get(card.id, locale, premium)
+			if seconds is not None:
+				recorded[card.id] = seconds
+		scale = DEFAULT_SCALE
+		total = sum(estimates[i] for i in recorded)
+		if total > 0:
+			scale = sum(recorded.values()) / total
+		predicted = {i: recorded.get(i, e * scale) for i, e in estimates.items()}
+		return (predicted, bool(recorded))
+
+	def save(self):
+		os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+		tmp = self.path + ".tmp"
+		with open(tmp, "w") as f:
+			json.dump(self.times, f, sort_keys=True)
+		os.replace(tmp, self.path)
+
+
+def makespan(costs, workers):
+	"""The time to run tasks of the given costs, in order, on workers that
+	each take the next task when they are idle."""
+	loads = [0.0] * max(1, workers)
+	for cost in costs:
+		heapq.heapreplace(loads, loads[0] + cost)
+	return max(loads)
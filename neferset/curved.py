@@ -1,8 +1,10 @@
 import sys
 import math
+import bisect
 import cairo
 from .drawing import path_with_control_points, text_path
-from .geometry import Point
+from .geometry import Point, cumulative_lengths
+from . import quality
 
 
 class CubicBezier:
@@ -41,49 +43,59 @@ class CubicBezier:
 			self._length = self.estimate_length()
 		return self._length
 
+	def set_arc_lengths(self, arc_lengths, length):
+		"""Use a precomputed arc length table, it is unaffected by offset."""
+		self._arc_lengths = arc_lengths
+		self._length = length
+
 	def evaluate(self, t):
-		return Point(
+		return Point(*self.evaluate_xy(t))
+
+	def evaluate_xy(self, t):
+		"""evaluate as an (x, y) tuple, without allocating a Point."""
+		return (
 			self.a * t ** 3 + self.b * t ** 2 + self.c * t + self.d,
-		 	self.e * t ** 3 + self.f * t ** 2 + self.g * t + self.h)
+			self.e * t ** 3 + self.f * t ** 2 + self.g * t + self.h)
+
+	def evaluate_many(self, ts):
+		"""evaluate_xy for each t, a list of (x, y) tuples."""
+		a, b, c, d = self.a, self.b, self.c, self.d
+		e, f, g, h = self.e, self.f, self.g, self.h
+		return [(a * t ** 3 + b * t ** 2 + c * t + d,
+			e * t ** 3 + f * t ** 2 + g * t + h) for t in ts]
 
 	def tangent(self, t):
-		return Point(
+		return Point(*self.tangent_xy(t))
+
+	def tangent_xy(self, t):
+		return (
 			3 * self.a * t ** 2 + 2 * self.b * t + self.c,
 			3 * self.e * t ** 2 + 2 * self.f * t + self.g)
 
 	def parametrize(self, u):
-		table_len = len(self.arc_lengths)
-		target_len = u * self.arc_lengths[table_len - 1]
-		index, best = 0, 0
-
-		for i, v in enumerate(self.arc_lengths):
-			if i >= table_len - 1:
-				break
-			if v < target_len and v > best:
-				best = v
-				index = i
+		arc_lengths = self.arc_lengths
+		table_len = len(arc_lengths)
+		target_len = u * arc_lengths[table_len - 1]
+		# the last entry shorter than the target, the table is ascending
+		index = max(0, bisect.bisect_left(arc_lengths, target_len, 0, table_len - 1) - 1)
 
-		if self.arc_lengths[index] == target_len:
+		if arc_lengths[index] == target_len:
 			t = index / (table_len - 1)
 		else:
-			lb = self.arc_lengths[index]
-			la = self.arc_lengths[index + 1]
+			lb = arc_lengths[index]
+			la = arc_lengths[index + 1]
 			seg_len = la - lb
 			seg_frac = (target_len - lb) / seg_len
 			t = (index + seg_frac) / (table_len - 1)
 		return t
 
-	def estimate_length(self, segments=100):
+	def estimate_length(self, segments=None):
+		if not segments:
+			segments = quality.current.curve_segments
 		max = segments + 1
-		prev = self.evaluate(0)
-		self._arc_lengths = [0]
-		sum = 0
-		for i in range(1, max + 1):
-			p = self.evaluate(i / max)
-			sum += prev.distance(p)
-			prev = p
-			self._arc_lengths.append(sum)
-		return sum
+		points = self.evaluate_many([0] + [i / max for i in range(1, max + 1)])
+		self._arc_lengths = cumulative_lengths(points)
+		return self._arc_lengths[-1]
 
 	def offset(self, x, y):
 		"""Offset the curve postion by (x,y) amount"""
@@ -178,9 +190,9 @@ class CurvedText:
 		nt = r * nrng + nmin
 
 		t = self.curve.parametrize(nt)
-		sx, sy = self.curve.evaluate(t)
+		sx, sy = self.curve.evaluate_xy(t)
 
-		tx, ty = self.curve.tangent(t)
+		tx, ty = self.curve.tangent_xy(t)
 		px = -ty
 		py = tx
 
@@ -233,6 +245,12 @@ def curved_text(ctx, obj, text, font, debug=False):
 	curve = CubicBezier(
 		obj.start.x, obj.start.y, obj.c1.x, obj.c1.y,
 		obj.c2.x, obj.c2.y, obj.end.x, obj.end.y)
+	# the table for the current preset, computed on first use
+	segments = quality.current.curve_segments
+	if segments in obj.tables:
+		curve.set_arc_lengths(*obj.tables[segments])
+	else:
+		obj.tables[segments] = (curve.arc_lengths, curve.length)
 	text = CurvedText(curve, font, text)
 	if debug:
 		text.draw_curve(ctx)
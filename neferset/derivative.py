@@ -0,0 +1,156 @@
+import os
+import os.path
+import json
+import hashlib
+import cairo
+from .artstore import write_entry, map_entry, store_name, MappedEntries
+
+INDEX = "index.json"
+
+
+def size_dir(size):
+	return "{}x{}".format(*size)
+
+
+def file_hash(path):
+	h = hashlib.sha1()
+	with open(path, "rb") as f:
+		for chunk in iter(lambda: f.read(1 << 20), b""):
+			h.update(chunk)
+	return h.hexdigest()
+
+
+def resize(img, size):
+	"""Resample a surface to size with the best filter, for downscaling."""
+	out = cairo.ImageSurface(cairo.FORMAT_ARGB32, *size)
+	ctx = cairo.Context(out)
+	ctx.scale(size[0] / img.get_width(), size[1] / img.get_height())
+	ctx.set_source_surface(img)
+	pattern = ctx.get_source()
+	pattern.set_filter(cairo.FILTER_BEST)
+	# repeat the edge pixels, rather than fading into transparency
+	pattern.set_extend(cairo.EXTEND_PAD)
+	ctx.paint()
+	out.flush()
+	return out
+
+
+def build_derivatives(src_path, cache_dir, sizes, entry=None):
+	"""Resize a source image to each size, returns its index entry and the
+	number of derivatives built. Sources with the same content share them.
+
+	entry -- the source's previous index entry, to skip hashing it again
+	"""
+	stat = os.stat(src_path)
+	if entry and is_current(entry, src_path):
+		digest = entry["hash"]
+	else:
+		digest = file_hash(src_path)
+	img = None
+	built = 0
+	for size in sizes:
+		dest = os.path.join(cache_dir, size_dir(size), store_name(digest))
+		if os.path.isfile(dest):
+			continue
+		os.makedirs(os.path.dirname(dest), exist_ok=True)
+		if img is None:
+			img = cairo.ImageSurface.create_from_png(src_path)
+		out = resize(img, size)
+		write_entry(out, dest, stat)
+		out.finish()
+		built += 1
+	if img:
+		img.finish()
+	entry = {"mtime": stat.st_mtime_ns, "size": stat.st_size, "hash": digest}
+	return (entry, built)
+
+
+def load_index(cache_dir):
+	path = os.path.join(cache_dir, INDEX)
+	if not os.path.isfile(path):
+		return {}
+	with open(path) as f:
+		return json.load(f)
+
+
+def save_index(cache_dir, index):
+	path = os.path.join(cache_dir, INDEX)
+	with open(path + ".tmp", "w") as f:
+		json.dump(index, f, sort_keys=True)
+	os.replace(path + ".tmp", path)
+
+
+def is_current(entry, src_path):
+	try:
+		stat = os.stat(src_path)
+	except FileNotFoundError:
+		return False
+	return entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size
+
+
+class DerivativeCache:
+	"""Artwork pre-resized to the size it is drawn at.
+
+	Derivatives are keyed by the hash of the source file and their size in
+	pixels. A source that changed since the cache was built, or a size that
+	was not built, falls back to the wrapped art store (if any) and then to
+	decoding the full size file.
+	"""
+	def __init__(self, cache_dir, art_dir, fallback=None):
+		if not os.path.isdir(cache_dir):
+			raise FileNotFoundError("Derivative cache not found ({})".format(cache_dir))
+		self.cache_dir = cache_dir
+		self.art_dir = art_dir
+		self.fallback = fallback
+		self.index = load_index(cache_dir)
+		self.hits = 0
+		self.misses = 0
+		self._current = {}
+		self._mapped = MappedEntries()
+
+	def get(self, name, size=None):
+		"""Get a surface for an art file name, of the given size when it is
+		cached, otherwise the fallback's, None if neither has it."""
+		surface = self._derivative(name, size) if size else None
+		if surface:
+			self.hits += 1
+			return surface
+		self.misses += 1
+		return self.fallback.get(name, size) if self.fallback else None
+
+	def _derivative(self, name, size):
+		entry = self.index.get(name)
+		if not entry:
+			return None
+		# check the source once per run, it may have changed since the build,
+		# a source that is not there uses the derivatives as they are
+		if name not in self._current:
+			src = os.path.join(self.art_dir, name)
+			self._current[name] = not os.path.exists(src) or is_current(entry, src)
+		if not self._current[name]:
+			return None
+		key = (entry["hash"], size)
+		if key in self._mapped:
+			return self._mapped.get(key)
+		return self._mapped.add(key, map_entry(os.path.join(
+			self.cache_dir, size_dir(size), store_name(entry["hash"]))))
+
+	def has(self, name):
+		"""Whether name has derivatives (of some size) or the fallback has it,
+		e.g. to draw a portrait that is not in the art dir."""
+		return name in self.index or bool(self.fallback and self.fallback.has(name))
+
+	def refresh(self, art_dir, name):
+		"""Recheck the source of name after it is modified, it is drawn
+		from the fallback until the derivatives are rebuilt."""
+		self._current.pop(name, None)
+		if self.fallback:
+			self.fallback.refresh(art_dir, name)
+
+	def clear(self):
+		self._mapped.clear()
+		if self.fallback:
+			self.fallback.clear()
+
+	def __str__(self):
+		return "{} hits, {} misses".format(self.hits, self.misses)
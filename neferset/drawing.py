@@ -1,8 +1,40 @@
 import math
 import os
 import cairo
-from gi.repository import Pango
-from gi.repository import PangoCairo
+from . import quality, metrics
+from .assets import exists
+
+# loaded on first use by load_pango and load_rsvg, gi is slow to import
+Pango = None
+PangoCairo = None
+Rsvg = None
+etree = None
+# pre-rendered text, see text_sprite
+SPRITES = {}
+# text origins are rounded to this fraction of a device pixel, see snap_origin
+SUBPIXEL_STEPS = 4
+
+
+def load_pango():
+	global Pango, PangoCairo
+	if PangoCairo:
+		return
+	import gi
+	gi.require_version("Pango", "1.0")
+	gi.require_version("PangoCairo", "1.0")
+	from gi.repository import Pango as pango, PangoCairo as pango_cairo
+	Pango, PangoCairo = pango, pango_cairo
+
+
+def load_rsvg():
+	global Rsvg, etree
+	if Rsvg:
+		return
+	import gi
+	gi.require_version("Rsvg", "2.0")
+	from gi.repository import Rsvg as rsvg
+	from lxml import etree as lxml_etree
+	Rsvg, etree = rsvg, lxml_etree
 
 
 def xheight(pg_ctx):
@@ -12,14 +44,14 @@ def xheight(pg_ctx):
 
 def text_path(context, font, size, text, debug=False):
 	"""Create a Pango text layout and return it as a Cairo path"""
+	load_pango()
 
 	context.save()
 
 	pg_layout = PangoCairo.create_layout(context)
 	pg_context = pg_layout.get_context()
 
-	font_options = cairo.FontOptions()
-	font_options.set_antialias(cairo.ANTIALIAS_SUBPIXEL)
+	font_options = quality.current.font_options()
 	PangoCairo.context_set_font_options(pg_context, font_options)
 	font_descp = "{0} {1:d}".format(font, size)
 	pg_layout.set_font_description(Pango.FontDescription(font_descp))
@@ -170,20 +202,89 @@ def polygon(ctx, points, draw=True, stroke=0.5, color=(0, 0, 0)):
 	ctx.restore()
 
 
-def text(ctx, obj, text, font, lang="en-US", debug=False):
-	ctx.save()
+def polygon_path(points):
+	"""Create a closed polygon as a cairo path, to be used with append_path."""
+	surface = cairo.ImageSurface(cairo.FORMAT_A8, 1, 1)
+	ctx = cairo.Context(surface)
+	polygon(ctx, points, False)
+	ctx.close_path()
+	path = ctx.copy_path()
+	surface.finish()
+	return path
+
 
+def text_layout(ctx, text, font, lang):
+	"""Create the Pango layout of a single line of text."""
 	lyt = PangoCairo.create_layout(ctx)
 	pg_ctx = lyt.get_context()
 	pg_ctx.set_language(Pango.Language.from_string(lang))
 
-	fo = cairo.FontOptions()
-	fo.set_antialias(cairo.ANTIALIAS_SUBPIXEL)
+	fo = quality.current.font_options()
 	PangoCairo.context_set_font_options(pg_ctx, fo)
 	font_family = font.family if not font.replace else font.replace
 	pg_font = Pango.FontDescription("{} {}px".format(font_family, font.size))
 	lyt.set_font_description(pg_font)
 	lyt.set_text(text, -1) # force length calculation
+	return lyt
+
+
+def outline_width(font):
+	stroke_width = font.size * 0.066
+	return 5.0 if stroke_width < 5.0 else stroke_width
+
+
+def stroke_text_layout(ctx, lyt, font):
+	"""Draw the outline of a layout at the current point, if the font has one."""
+	PangoCairo.update_layout(ctx, lyt)
+	if font.outline:
+		PangoCairo.layout_path(ctx, lyt)
+		ctx.set_line_width(outline_width(font))
+		ctx.set_line_cap(cairo.LINE_CAP_ROUND)
+		ctx.set_line_join(cairo.LINE_JOIN_ROUND)
+		ctx.set_source_rgb(*font.outline)
+		ctx.stroke()
+
+
+def fill_text_layout(ctx, lyt, font):
+	"""Draw the glyphs of a layout at the current point."""
+	PangoCairo.update_layout(ctx, lyt)
+	ctx.set_source_rgb(*font.color)
+	PangoCairo.show_layout(ctx, lyt)
+
+
+def show_text_layout(ctx, lyt, font):
+	"""Draw a layout at the current point, with the font's outline."""
+	stroke_text_layout(ctx, lyt, font)
+	fill_text_layout(ctx, lyt, font)
+
+
+def sprites_allowed(ctx):
+	"""Whether text can be drawn from sprites in this context, not for a
+	rotated or skewed one or with subpixel antialiasing, where the glyphs
+	blend per colour channel."""
+	matrix = ctx.get_matrix()
+	return (matrix.xy == 0 and matrix.yx == 0
+		and quality.current.antialias != cairo.ANTIALIAS_SUBPIXEL)
+
+
+def snap_origin(ctx, x, y):
+	"""Round a text origin to a 1/SUBPIXEL_STEPS device pixel, so that text
+	and text sprites are rasterized at the same few sub-pixel offsets.
+	Only where sprites can be used, otherwise the origin is left as it is,
+	e.g. so the normal preset draws text as before."""
+	if not sprites_allowed(ctx):
+		return (x, y)
+	dx, dy = ctx.user_to_device(x, y)
+	return ctx.device_to_user(
+		round(dx * SUBPIXEL_STEPS) / SUBPIXEL_STEPS,
+		round(dy * SUBPIXEL_STEPS) / SUBPIXEL_STEPS)
+
+
+def text(ctx, obj, text, font, lang="en-US", debug=False):
+	load_pango()
+	ctx.save()
+
+	lyt = text_layout(ctx, text, font, lang)
 
 	# lyt.set_height(obj["height"])
 	# lyt.set_width(obj["height"])
@@ -203,26 +304,12 @@ def text(ctx, obj, text, font, lang="en-US", debug=False):
 	#y = obj["y"] - pext.y - pext.height / 2
 	x = (obj.x + obj.width / 2) - ((ink.x + ink.width / 2))
 	y = (obj.y + obj.height / 2) - ((ink.y + ink.height / 2))
+	x, y = snap_origin(ctx, x, y)
 	if debug:
 		print("x,y: %s, %s" % (x, y))
 	ctx.translate(x, y)
 
-	PangoCairo.update_layout(ctx, lyt)
-	PangoCairo.layout_path(ctx, lyt)
-
-	if font.outline:
-		# set stroke outline
-		stroke_width = font.size * 0.066
-		stroke_width = 5.0 if stroke_width < 5.0 else stroke_width
-
-		ctx.set_line_width(stroke_width)
-		ctx.set_line_cap(cairo.LINE_CAP_ROUND)
-		ctx.set_line_join(cairo.LINE_JOIN_ROUND)
-		ctx.set_source_rgb(*font.outline)
-		ctx.stroke()
-
-	ctx.set_source_rgb(*font.color)
-	PangoCairo.show_layout(ctx, lyt)
+	show_text_layout(ctx, lyt, font)
 
 	if debug:
 		ctx.rectangle(ink.x, ink.y, ink.width, ink.height)
@@ -243,15 +330,107 @@ def text(ctx, obj, text, font, lang="en-US", debug=False):
 		crosshair(ctx, obj.x, obj.y, 20, (1, 1, 1))
 
 
+class TextSprite:
+	"""A line of text rendered once, to be painted wherever it is needed.
+
+	The ink extents are those of the layout at the sprite's scale. The
+	outline and the glyphs are kept as separate images, each the colour in
+	the coverage of the text over transparent, and are painted in turn as
+	text() draws them, so each blends with the card in the same way. Images
+	are kept for each snapped sub-pixel offset of the text origin.
+	"""
+	def __init__(self, ctx, text, font, lang):
+		self.text = text
+		self.font = font
+		self.lang = lang
+		lyt = text_layout(ctx, text, font, lang)
+		self.ink = lyt.get_pixel_extents()[0]
+		self.images = {}
+
+	def image(self, matrix, antialias, qx, qy):
+		"""The outline (None without one) and glyph surfaces and the device
+		offset of the text origin in them, for an origin qx, qy steps of
+		1/SUBPIXEL_STEPS into a pixel."""
+		key = (qx, qy, antialias)
+		if key not in self.images:
+			ink = self.ink
+			margin = (outline_width(self.font) / 2 if self.font.outline else 0) + 2
+			ox = math.ceil((margin - ink.x) * matrix.xx)
+			oy = math.ceil((margin - ink.y) * matrix.yy)
+			width = ox + math.ceil((ink.x + ink.width + margin) * matrix.xx) + 1
+			height = oy + math.ceil((ink.y + ink.height + margin) * matrix.yy) + 1
+			layers = [None, None]
+			for i, draw in enumerate((stroke_text_layout, fill_text_layout)):
+				if i == 0 and not self.font.outline:
+					continue
+				surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+				ctx = cairo.Context(surface)
+				ctx.set_antialias(antialias)
+				ctx.translate(ox + qx / SUBPIXEL_STEPS, oy + qy / SUBPIXEL_STEPS)
+				ctx.scale(matrix.xx, matrix.yy)
+				draw(ctx, text_layout(ctx, self.text, self.font, self.lang), self.font)
+				surface.flush()
+				layers[i] = surface
+			self.images[key] = (layers[0], layers[1], ox, oy)
+		return self.images[key]
+
+
+def text_sprite(ctx, obj, text, font, lang="en-US"):
+	"""Draw a line of text as text() does, from a cache of pre-rendered text.
+
+	Meant for the short strings repeated on many cards, e.g. stat numbers.
+	The sprites are keyed by the text, font, language and output scale.
+	Where they can't be used (see sprites_allowed) the text is drawn.
+	"""
+	if not sprites_allowed(ctx):
+		text(ctx, obj, text, font, lang)
+		return
+	matrix = ctx.get_matrix()
+	load_pango()
+	key = (text, font.replace or font.family, font.size,
+		tuple(font.outline or ()), tuple(font.color), lang, matrix.xx, matrix.yy,
+		quality.current.name)
+	sprite = SPRITES.get(key)
+	metrics.cache("text", sprite is not None)
+	if not sprite:
+		sprite = SPRITES[key] = TextSprite(ctx, text, font, lang)
+	ink = sprite.ink
+	# the same snapped origin text() translates to, in device steps
+	x = (obj.x + obj.width / 2) - ((ink.x + ink.width / 2))
+	y = (obj.y + obj.height / 2) - ((ink.y + ink.height / 2))
+	dx, dy = ctx.user_to_device(x, y)
+	qx, qy = int(round(dx * SUBPIXEL_STEPS)), int(round(dy * SUBPIXEL_STEPS))
+	ix, iy = qx // SUBPIXEL_STEPS, qy // SUBPIXEL_STEPS
+	stroke, fill, ox, oy = sprite.image(
+		matrix, ctx.get_antialias(), qx % SUBPIXEL_STEPS, qy % SUBPIXEL_STEPS)
+	ctx.save()
+	ctx.identity_matrix()
+	for surface in (stroke, fill):
+		if surface:
+			ctx.set_source_surface(surface, ix - ox, iy - oy)
+			ctx.paint()
+	ctx.restore()
+
+
+def clear_sprites():
+	"""Drop the pre-rendered text, e.g. when the theme fonts change."""
+	for sprite in SPRITES.values():
+		for stroke, fill, _, _ in sprite.images.values():
+			for surface in (stroke, fill):
+				if surface:
+					surface.finish()
+	SPRITES.clear()
+
+
 def text_block(ctx, obj, text, font, lang="en-US", debug=False):
+	load_pango()
 	ctx.save()
 
 	lyt = PangoCairo.create_layout(ctx)
 	pg_ctx = lyt.get_context()
 	pg_ctx.set_language(Pango.Language.from_string(lang))
 
-	fo = cairo.FontOptions()
-	fo.set_antialias(cairo.ANTIALIAS_SUBPIXEL)
+	fo = quality.current.font_options()
 	PangoCairo.context_set_font_options(pg_ctx, fo)
 	font_family = font.family if not font.replace else font.replace
 	pg_font = Pango.FontDescription("{} {}px".format(font_family, font.size))
@@ -301,23 +480,57 @@ def get_scale(img, w, h):
 	return (round(float(w) / img.get_width(), 2), round(float(h) / img.get_height(), 2))
 
 
-def draw_png_asset(context, image, dir, f):
+def device_size(context, w, h):
+	"""The size in pixels of a (w, h) region of the context."""
+	dw, dh = context.user_to_device_distance(w, h)
+	return (int(round(abs(dw))), int(round(abs(dh))))
+
+
+def draw_png_asset(context, image, dir, f, store=None, cache=None):
+	"""Draw an image asset or artwork, from the store when it has it, cache
+	names the store in the run metrics."""
 	file = f
 	if f in image.assets:
 		file = image.assets[f]
+	# use the pre-decoded art when there is a store entry for it
+	img = None
+	if store:
+		size = device_size(context, image.width, image.height)
+		img = store.get(file, size)
+		if cache:
+			metrics.cache(cache, img is not None)
+	if img and (img.get_width(), img.get_height()) == size:
+		# already resized, fill the region exactly
+		draw_surface_at(context, img, image.x, image.y, image.width, image.height, False)
+		return
+	if img:
+		draw_surface_at(context, img, image.x, image.y, image.width, image.height)
+		return
+	# a compiled theme has already resolved and checked the asset path
+	if f in image.paths:
+		draw_png_at(context, image.paths[f], image.x, image.y, image.width, image.height, False)
+		return
 	file_path = os.path.join(dir, file)
 	draw_png_at(context, file_path, image.x, image.y, image.width, image.height)
 
 
-def draw_png_at(context, file, x, y, w, h):
-	if not os.path.isfile(file):
+def draw_png_at(context, file, x, y, w, h, check=True):
+	if check and not exists(file):
 		print("File ({}) not found".format(file))
 		return
-	context.save()
 	img = cairo.ImageSurface.create_from_png(file)
-	scale = get_scale(img, w, h)
+	draw_surface_at(context, img, x, y, w, h)
+
+
+def draw_surface_at(context, img, x, y, w, h, rounded=True):
+	context.save()
+	if rounded:
+		scale = get_scale(img, w, h)
+	else:
+		scale = (w / img.get_width(), h / img.get_height())
 	context.translate(x, y)
 	context.scale(*scale) # TODO only scale when no (1, 1)
 	context.set_source_surface(img)
+	context.get_source().set_filter(quality.current.filter)
 	context.paint()
 	context.restore()
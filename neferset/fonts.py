@@ -0,0 +1,63 @@
+import cairo
+from . import drawing
+
+# text in each locale's script, used to load the glyphs a locale needs
+SCRIPT_SAMPLES = {
+	"zhCN": "的一是不了人我在有他这为之大来以个中上们随从召唤法术伤害",
+	"zhTW": "的一是不了人我在有他這為之大來以個中上們隨從召喚法術傷害",
+	"jaJP": "あいうえおかきくけこアイウエオカキクケコ召喚呪文攻撃体力",
+	"koKR": "가나다라마바사아자차카타파하하수인주문피해",
+	"thTH": "กขคฆงจฉชซฌญฎฏฐฑฒณดตถทธนบปผฝพฟภมยรลวศษสหฬอฮ",
+	"ruRU": "АБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯабвгдеёжзийклмнопрстуфхцчшщъыьэюя",
+}
+LATIN_SAMPLE = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789ÀÉÎÕÜßçñ"
+
+
+def theme_families(theme):
+	"""The font families used by a theme, after any replacements."""
+	families = set()
+	for components in theme.card_types.values():
+		for c in components:
+			if c.font and c.font.family:
+				families.add(c.font.replace or c.font.family)
+	return families
+
+
+def prewarm_fonts(families, locale_name, lang):
+	"""Resolve each font family for a locale and load the glyphs it needs.
+
+	Pango resolves families and fallback fonts on first use, this does it up
+	front so that rendering starts with a warm font map. Returns a list of
+	warnings, for missing families and families lacking glyphs for the
+	locale's script (which would use a fallback font).
+	"""
+	drawing.load_pango()
+	Pango, PangoCairo = drawing.Pango, drawing.PangoCairo
+	warnings = []
+	sample = SCRIPT_SAMPLES.get(locale_name, LATIN_SAMPLE)
+	font_map = PangoCairo.FontMap.get_default()
+	available = set(f.get_name().lower() for f in font_map.list_families())
+	language = Pango.Language.from_string(lang)
+
+	surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 1, 1)
+	ctx = cairo.Context(surface)
+	layout = PangoCairo.create_layout(ctx)
+	layout.get_context().set_language(language)
+	for family in sorted(families):
+		if family.lower() not in available:
+			warnings.append("Font '{}' not found".format(family))
+		desc = Pango.FontDescription("{} 20px".format(family))
+		font = font_map.load_font(layout.get_context(), desc)
+		if font:
+			coverage = font.get_coverage(language)
+			missing = [ch for ch in sample
+				if coverage.get(ord(ch)) == Pango.CoverageLevel.NONE]
+			if missing:
+				warnings.append("Font '{}' is missing {} of {} {} glyphs, a fallback will be used".format(
+					family, len(missing), len(sample), locale_name))
+		# laying out the sample loads the font and any fallbacks for the script
+		layout.set_font_description(desc)
+		layout.set_text(sample, -1)
+		layout.get_pixel_extents()
+	surface.finish()
+	return warnings
@@ -1,12 +1,11 @@
 import math
 
 class Vector4():
+	__slots__ = ("x", "y", "z", "w")
+
 	def __init__(self, *args):
 		if len(args) == 4:
-			self.x = args[0]
-			self.y = args[1]
-			self.z = args[2]
-			self.w = args[3]
+			self.x, self.y, self.z, self.w = args
 		else:
 			raise ValueError("Wrong number of arguments ({})".format(len(args)))
 
@@ -43,34 +42,68 @@ class Vector4():
 		self.w = value
 
 	def __add__(self, o):
-		try:
-			out = Vector4(self.x + o.x, self.y + o.y, self.z + o.z, self.w + o.w)
-		except AttributeError:
-			out = Vector4(self.x + o, self.y + o, self.z + o, self.w + o)
-		return out
+		if isinstance(o, Vector4):
+			return Vector4(self.x + o.x, self.y + o.y, self.z + o.z, self.w + o.w)
+		return Vector4(self.x + o, self.y + o, self.z + o, self.w + o)
 
 	def __sub__(self, o):
-		try:
-			out = Vector4(self.x - o.x, self.y - o.y, self.z - o.z, self.w - o.w)
-		except AttributeError:
-			out = Vector4(self.x - o, self.y - o, self.z - o, self.w - o)
-		return out
+		if isinstance(o, Vector4):
+			return Vector4(self.x - o.x, self.y - o.y, self.z - o.z, self.w - o.w)
+		return Vector4(self.x - o, self.y - o, self.z - o, self.w - o)
 
 	def __mul__(self, o):
-		try:
-			out = Vector4(self.x * o.x, self.y * o.y, self.z * o.z, self.w * o.w)
-		except AttributeError:
-			out = Vector4(self.x * o, self.y * o, self.z * o, self.w * o)
-		return out
+		if isinstance(o, Vector4):
+			return Vector4(self.x * o.x, self.y * o.y, self.z * o.z, self.w * o.w)
+		return Vector4(self.x * o, self.y * o, self.z * o, self.w * o)
 
 	def __rmul__(self, s):
 		return Vector4(self.x * s, self.y * s, self.z * s, self.w * s)
 
+	# in-place versions, update and return self rather than allocating, so
+	# a += b now changes a for every name bound to it (it used to rebind a
+	# to a new Vector4), clone or use a + b where the original is shared
+
+	def __iadd__(self, o):
+		if isinstance(o, Vector4):
+			self.x += o.x
+			self.y += o.y
+			self.z += o.z
+			self.w += o.w
+		else:
+			self.x += o
+			self.y += o
+			self.z += o
+			self.w += o
+		return self
+
+	def __isub__(self, o):
+		if isinstance(o, Vector4):
+			self.x -= o.x
+			self.y -= o.y
+			self.z -= o.z
+			self.w -= o.w
+		else:
+			self.x -= o
+			self.y -= o
+			self.z -= o
+			self.w -= o
+		return self
+
+	def __imul__(self, o):
+		if isinstance(o, Vector4):
+			self.x *= o.x
+			self.y *= o.y
+			self.z *= o.z
+			self.w *= o.w
+		else:
+			self.x *= o
+			self.y *= o
+			self.z *= o
+			self.w *= o
+		return self
+
 	def __iter__(self):
-		yield self.x
-		yield self.y
-		yield self.z
-		yield self.w
+		return iter((self.x, self.y, self.z, self.w))
 
 	def __str__(self):
 		return "({:.2f}, {:.2f}, {:.2f}, {:.2f})".format(self.x, self.y, self.z, self.w)
@@ -80,6 +113,8 @@ class Vector4():
 
 
 class Point:
+	__slots__ = ("x", "y")
+
 	def __init__(self, x=0, y=0):
 		self.x = x
 		self.y = y
@@ -94,11 +129,39 @@ class Point:
 		return Point(self.x * s, self.y * s)
 
 	def __rmul__(self, s):
-		return Point.__mul__(self, s)
+		return Point(self.x * s, self.y * s)
 
-	def __div__(self, s):
+	def __truediv__(self, s):
 		return Point(self.x / s, self.y / s)
 
+	__div__ = __truediv__
+
+	# in-place, as for Vector4, p += q changes p for every name bound to it
+	def __iadd__(self, p):
+		self.x += p.x
+		self.y += p.y
+		return self
+
+	def __isub__(self, p):
+		self.x -= p.x
+		self.y -= p.y
+		return self
+
+	def __imul__(self, s):
+		self.x *= s
+		self.y *= s
+		return self
+
+	def __itruediv__(self, s):
+		self.x /= s
+		self.y /= s
+		return self
+
+	def set(self, x, y):
+		self.x = x
+		self.y = y
+		return self
+
 	def distance(self, p):
 		return math.sqrt((p.x - self.x) ** 2 + (p.y - self.y) ** 2)
 
@@ -106,11 +169,26 @@ class Point:
 		return Point(self.x, self.y)
 
 	def __iter__(self):
-		yield self.x
-		yield self.y
+		return iter((self.x, self.y))
 
 	def __str__(self):
 		return "({0:.2f}, {1:.2f})".format(self.x, self.y)
 
 	def __repr__(self):
 		return "{0}({1}, {2})".format(self.__class__.__name__, self.x, self.y)
+
+
+# batched operations on many points, as sequences of (x, y) tuples
+
+def cumulative_lengths(coords):
+	"""The distance along a polyline to each of its (x, y) points."""
+	lengths = [0]
+	total = 0
+	sqrt = math.sqrt
+	it = iter(coords)
+	px, py = next(it)
+	for x, y in it:
+		total += sqrt((x - px) ** 2 + (y - py) ** 2)
+		lengths.append(total)
+		px, py = x, y
+	return lengths
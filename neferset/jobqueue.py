@@ -0,0 +1,187 @@
+import os
+import time
+import socket
+import sqlite3
+import threading
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+	id INTEGER PRIMARY KEY,
+	card_id TEXT NOT NULL,
+	locale TEXT NOT NULL,
+	premium INTEGER NOT NULL,
+	width INTEGER NOT NULL,
+	state TEXT NOT NULL DEFAULT 'pending',
+	attempts INTEGER NOT NULL DEFAULT 0,
+	owner TEXT,
+	lease_expires REAL,
+	finished REAL,
+	output TEXT,
+	error TEXT,
+	UNIQUE (card_id, locale, premium, width)
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_expires);
+"""
+
+
+def worker_name():
+	"""Identify a worker process, unique across the hosts sharing a store."""
+	return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+class Job:
+	def __init__(self, row):
+		self.id, self.card_id, self.locale, premium, self.width, self.attempts = row
+		self.premium = bool(premium)
+
+	def __str__(self):
+		return "{} {} {}{}".format(
+			self.card_id, self.locale, self.width, " premium" if self.premium else "")
+
+
+class JobQueue:
+	"""A render job queue stored in a local SQLite database.
+
+	Workers claim jobs with a lease, a job whose lease expires before it is
+	marked done is claimed again, until it has failed max_attempts times.
+	The store can be shared by workers on several hosts, provided the file
+	system supports file locking, so the rollback journal is used not WAL.
+	"""
+	def __init__(self, path, max_attempts=3, timeout=60):
+		self.path = path
+		self.max_attempts = max_attempts
+		# autocommit, transactions are started explicitly
+		self.db = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+		self.db.executescript(SCHEMA)
+
+	def close(self):
+		self.db.close()
+
+	def enqueue(self, jobs):
+		"""Add (card id, locale, premium, width) jobs, ignoring existing ones.
+
+		Returns the number of jobs added.
+		"""
+		before = self.db.total_changes
+		self.db.execute("BEGIN IMMEDIATE")
+		try:
+			self.db.executemany(
+				"INSERT OR IGNORE INTO jobs (card_id, locale, premium, width) "
+				"VALUES (?, ?, ?, ?)",
+				((c, l, int(p), w) for c, l, p, w in jobs))
+			self.db.execute("COMMIT")
+		except:
+			self.db.execute("ROLLBACK")
+			raise
+		return self.db.total_changes - before
+
+	def claim(self, worker, lease=300, limit=1):
+		"""Lease up to limit pending or expired jobs to worker."""
+		now = time.time()
+		self.db.execute("BEGIN IMMEDIATE")
+		try:
+			rows = self.db.execute(
+				"SELECT id, card_id, locale, premium, width, attempts FROM jobs "
+				"WHERE (state = ? OR (state = ? AND lease_expires < ?)) "
+				"AND attempts < ? ORDER BY id LIMIT ?",
+				(PENDING, LEASED, now, self.max_attempts, limit)).fetchall()
+			self.db.executemany(
+				"UPDATE jobs SET state = ?, owner = ?, lease_expires = ?, "
+				"attempts = attempts + 1 WHERE id = ?",
+				((LEASED, worker, now + lease, r[0]) for r in rows))
+			self.db.execute("COMMIT")
+		except:
+			self.db.execute("ROLLBACK")
+			raise
+		return [Job(r) for r in rows]
+
+	def renew(self, worker, lease=300):
+		"""Extend the leases of the jobs worker holds, returns how many."""
+		return self.db.execute(
+			"UPDATE jobs SET lease_expires = ? WHERE state = ? AND owner = ?",
+			(time.time() + lease, LEASED, worker)).rowcount
+
+	def complete(self, job, worker, output=None):
+		self.db.execute(
+			"UPDATE jobs SET state = ?, finished = ?, output = ?, error = NULL "
+			"WHERE id = ? AND owner = ?",
+			(DONE, time.time(), output, job.id, worker))
+
+	def fail(self, job, worker, error):
+		"""Record a failed job, it is retried until it reaches max_attempts."""
+		state = FAILED if job.attempts + 1 >= self.max_attempts else PENDING
+		self.db.execute(
+			"UPDATE jobs SET state = ?, finished = ?, error = ? "
+			"WHERE id = ? AND owner = ?",
+			(state, time.time(), error, job.id, worker))
+
+	def expire_exhausted(self):
+		"""Mark leased jobs that expired on their last attempt as failed."""
+		self.db.execute(
+			"UPDATE jobs SET state = ?, error = 'lease expired' "
+			"WHERE state = ? AND lease_expires < ? AND attempts >= ?",
+			(FAILED, LEASED, time.time(), self.max_attempts))
+
+	def counts(self):
+		"""Get the number of jobs in each state."""
+		counts = {s: 0 for s in (PENDING, LEASED, DONE, FAILED)}
+		for state, count in self.db.execute(
+				"SELECT state, COUNT(*) FROM jobs GROUP BY state"):
+			counts[state] = count
+		return counts
+
+	def unfinished(self):
+		counts = self.counts()
+		return counts[PENDING] + counts[LEASED]
+
+	def throughput(self, window=300):
+		"""Jobs finished per second over the last window seconds."""
+		since = time.time() - window
+		done, first = self.db.execute(
+			"SELECT COUNT(*), MIN(finished) FROM jobs WHERE state = ? AND finished >= ?",
+			(DONE, since)).fetchone()
+		if not done:
+			return 0.0
+		return done / max(time.time() - first, 1.0)
+
+	def failures(self, limit=10):
+		return self.db.execute(
+			"SELECT card_id, locale, premium, width, error FROM jobs "
+			"WHERE state = ? ORDER BY finished DESC LIMIT ?",
+			(FAILED, limit)).fetchall()
+
+
+class LeaseHeartbeat:
+	"""Renew a worker's leases from a thread while it renders, so a job that
+	takes longer than the lease isn't claimed by another worker. The leases
+	of a worker that dies are not renewed, and expire as before.
+	"""
+	def __init__(self, path, worker, lease=300):
+		self.path = path
+		self.worker = worker
+		self.lease = lease
+		self.interval = lease / 3
+		self._stop = threading.Event()
+		self._thread = threading.Thread(target=self._run, daemon=True)
+		self._thread.start()
+
+	def _run(self):
+		# a connection of its own, they can't be shared between threads
+		queue = JobQueue(self.path)
+		try:
+			while not self._stop.wait(self.interval):
+				try:
+					queue.renew(self.worker, self.lease)
+				except sqlite3.Error as e:
+					print("Lease renewal failed: {}".format(e))
+		finally:
+			queue.close()
+
+	def stop(self):
+		self._stop.set()
+		self._thread.join()
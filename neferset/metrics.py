@@ -0,0 +1,226 @@
+import os
+import json
+import math
+import time
+import threading
+
+# counters updated while rendering, per process, see take
+CACHES = {} # cache name -> [hits, misses]
+STAGES = {} # stage name -> seconds
+OUTCOMES = {} # (outcome, reason) -> renders, for those not saved
+
+
+def cache(name, hit):
+	counts = CACHES.setdefault(name, [0, 0])
+	counts[0 if hit else 1] += 1
+
+
+def stage(name, seconds):
+	STAGES[name] = STAGES.get(name, 0) + seconds
+
+
+def outcome(kind, reason, count=1):
+	"""Count renders that are skipped, unsupported or failed, by reason."""
+	key = (kind, reason)
+	OUTCOMES[key] = OUTCOMES.get(key, 0) + count
+
+
+def take():
+	"""Return and reset the counters, e.g. to send them from a worker
+	process to the parent with the card it rendered."""
+	counts = {
+		"caches": {k: list(v) for k, v in CACHES.items()},
+		"stages": dict(STAGES),
+		"outcomes": dict(OUTCOMES)
+	}
+	CACHES.clear()
+	STAGES.clear()
+	OUTCOMES.clear()
+	return counts
+
+
+def percentile(ordered, p):
+	"""Nearest rank percentile of a sorted list, 0 when it is empty."""
+	if not ordered:
+		return 0
+	rank = math.ceil(p / 100 * len(ordered)) - 1
+	return ordered[max(0, min(len(ordered) - 1, rank))]
+
+
+def prom_label(value):
+	return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class RunMetrics:
+	"""Collect the metrics of a run and write them out periodically.
+
+	Each write appends a snapshot to a JSON lines file and replaces a
+	Prometheus textfile (the same path with a .prom extension), so a run
+	can be followed while it goes. The counters of each card are added with
+	record, from this process or a worker's results. A timer thread writes
+	every interval seconds, so a slow card or a stalled run still shows,
+	close stops it and writes the final snapshot.
+	"""
+	def __init__(self, path, interval=10, labels=None):
+		if interval <= 0:
+			raise ValueError("The metrics interval must be more than 0 seconds")
+		self.path = path
+		self.prom_path = os.path.splitext(path)[0] + ".prom"
+		self.interval = interval
+		self.labels = labels or {}
+		self.start = time.perf_counter()
+		self.cards = 0
+		self.outputs = 0
+		self.latencies = []
+		self.caches = {}
+		self.stages = {}
+		self.outcomes = {}
+		self._lock = threading.Lock()
+		self._stop = threading.Event()
+		os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+		# a run starts a new file, the snapshots are cumulative
+		open(path, "w").close()
+		self._timer = threading.Thread(target=self._write_loop, daemon=True)
+		self._timer.start()
+
+	def _write_loop(self):
+		while not self._stop.wait(self.interval):
+			self.write()
+
+	def close(self):
+		"""Stop the timer and write the final snapshot."""
+		self._stop.set()
+		self._timer.join()
+		return self.write(True)
+
+	def add(self, counts):
+		with self._lock:
+			self._add(counts)
+
+	def _add(self, counts):
+		for name, (hits, misses) in counts["caches"].items():
+			c = self.caches.setdefault(name, [0, 0])
+			c[0] += hits
+			c[1] += misses
+		for name, seconds in counts["stages"].items():
+			self.stages[name] = self.stages.get(name, 0) + seconds
+		for key, n in counts["outcomes"].items():
+			self.outcomes[key] = self.outcomes.get(key, 0) + n
+
+	def record(self, outputs, seconds, counts):
+		"""Add a card, the number of outputs saved and its render time."""
+		with self._lock:
+			self.cards += 1
+			self.outputs += outputs
+			if outputs:
+				self.latencies.append(seconds)
+			self._add(counts)
+
+	def snapshot(self, final=False):
+		with self._lock:
+			return self._snapshot(final)
+
+	def _snapshot(self, final):
+		elapsed = time.perf_counter() - self.start
+		ordered = sorted(self.latencies)
+		total = sum(self.stages.values())
+		outcomes = {}
+		for (kind, reason), n in sorted(self.outcomes.items()):
+			outcomes.setdefault(kind, {})[reason] = n
+		return {
+			"time": time.time(),
+			"final": final,
+			"labels": self.labels,
+			"elapsed": elapsed,
+			"cards": self.cards,
+			"outputs": self.outputs,
+			"cards_per_second": self.cards / elapsed if elapsed else 0,
+			"latency": {
+				"p50": percentile(ordered, 50),
+				"p90": percentile(ordered, 90),
+				"p99": percentile(ordered, 99),
+				"max": ordered[-1] if ordered else 0
+			},
+			"stages": {name: {
+				"seconds": s,
+				"share": s / total if total else 0
+			} for name, s in sorted(self.stages.items())},
+			"caches": {name: {
+				"hits": hits,
+				"misses": misses,
+				"hit_rate": hits / (hits + misses) if hits + misses else 0
+			} for name, (hits, misses) in sorted(self.caches.items())},
+			"outcomes": outcomes
+		}
+
+	def write(self, final=False):
+		with self._lock:
+			snap = self._snapshot(final)
+			latencies = (sum(self.latencies), len(self.latencies))
+			with open(self.path, "a") as f:
+				f.write(json.dumps(snap, sort_keys=True) + "\n")
+			# replaced in one step, so the collector never reads a partial file
+			tmp = self.prom_path + ".tmp"
+			with open(tmp, "w") as f:
+				f.write(self.prometheus(snap, latencies))
+			os.replace(tmp, self.prom_path)
+		return snap
+
+	def prometheus(self, snap, latencies):
+		"""Format a snapshot in the Prometheus text exposition format,
+		latencies is the sum and count of the card render times."""
+		base = "".join(",{}=\"{}\"".format(k, prom_label(v))
+			for k, v in sorted(self.labels.items()))
+		lines = []
+
+		def metric(name, kind, desc, samples):
+			lines.append("# HELP neferset_{} {}".format(name, desc))
+			lines.append("# TYPE neferset_{} {}".format(name, kind))
+			for labels, value in samples:
+				label = ",".join("{}=\"{}\"".format(k, prom_label(v)) for k, v in labels)
+				label = (label + base).lstrip(",")
+				lines.append("neferset_{}{} {}".format(
+					name, "{" + label + "}" if label else "", value))
+
+		metric("elapsed_seconds", "gauge", "Seconds since the run started.",
+			[((), snap["elapsed"])])
+		metric("cards_total", "counter", "Cards rendered.", [((), snap["cards"])])
+		metric("outputs_total", "counter", "Card images saved.", [((), snap["outputs"])])
+		metric("cards_per_second", "gauge", "Cards rendered per second.",
+			[((), snap["cards_per_second"])])
+		metric("card_latency_seconds", "summary", "Render time per card.",
+			[((("quantile", q),), snap["latency"][p])
+				for q, p in (("0.5", "p50"), ("0.9", "p90"), ("0.99", "p99"))])
+		lines.append("neferset_card_latency_seconds_sum{} {}".format(
+			"{" + base.lstrip(",") + "}" if base else "", latencies[0]))
+		lines.append("neferset_card_latency_seconds_count{} {}".format(
+			"{" + base.lstrip(",") + "}" if base else "", latencies[1]))
+		metric("stage_seconds_total", "counter", "Seconds spent in each render stage.",
+			[((("stage", k),), v["seconds"]) for k, v in snap["stages"].items()])
+		metric("cache_hits_total", "counter", "Cache hits.",
+			[((("cache", k),), v["hits"]) for k, v in snap["caches"].items()])
+		metric("cache_misses_total", "counter", "Cache misses.",
+			[((("cache", k),), v["misses"]) for k, v in snap["caches"].items()])
+		metric("renders_not_saved_total", "counter",
+			"Renders skipped, unsupported or failed, by reason.",
+			[((("outcome", kind), ("reason", reason)), n)
+				for kind, reasons in snap["outcomes"].items()
+				for reason, n in reasons.items()])
+		return "\n".join(lines) + "\n"
+
+	def report(self):
+		"""Summary lines for the end of a run."""
+		snap = self.snapshot(True)
+		lines = ["Metrics: {:.2f} cards/s, latency p50 {:.3f}s p90 {:.3f}s p99 {:.3f}s".format(
+			snap["cards_per_second"], snap["latency"]["p50"], snap["latency"]["p90"],
+			snap["latency"]["p99"])]
+		if snap["stages"]:
+			lines.append("Stages: " + ", ".join("{} {:.0%}".format(k, v["share"])
+				for k, v in snap["stages"].items()))
+		if snap["caches"]:
+			lines.append("Caches: " + ", ".join("{} {:.0%}".format(k, v["hit_rate"])
+				for k, v in snap["caches"].items()))
+		for kind, reasons in snap["outcomes"].items():
+			lines.append("{}: {}".format(kind.capitalize(), ", ".join(
+				"{} {}".format(n, r) for r, n in reasons.items())))
+		return lines
@@ -0,0 +1,370 @@
+import io
+import os
+import os.path
+import json
+import time
+import hashlib
+import queue
+import tarfile
+import zipfile
+import threading
+import cairo
+from . import quality
+
+ATLAS_INDEX = "atlas.json"
+DEDUP_INDEX = "dedup.json"
+ZIP_COMPRESSION = {
+	"store": zipfile.ZIP_STORED,
+	"deflate": zipfile.ZIP_DEFLATED,
+	"bzip2": zipfile.ZIP_BZIP2,
+	"lzma": zipfile.ZIP_LZMA
+}
+TAR_COMPRESSION = {
+	"store": "",
+	"gz": "gz",
+	"bz2": "bz2",
+	"xz": "xz"
+}
+
+
+def write_png(surface, target):
+	"""Write a surface as PNG to a file name or object.
+
+	Cairo's encoder has a fixed compression level, when the quality preset
+	sets one the image is encoded with PIL instead.
+	"""
+	level = quality.current.png_level
+	if level is None:
+		surface.write_to_png(target)
+		return
+	from PIL import Image
+	surface.flush()
+	# cairo's ARGB32 is premultiplied BGRA in memory (little endian)
+	img = Image.frombuffer(
+		"RGBA", (surface.get_width(), surface.get_height()),
+		bytes(surface.get_data()), "raw", "BGRa", surface.get_stride(), 1)
+	img.save(target, "PNG", compress_level=level)
+	img.close()
+
+
+def variant_name(premium):
+	return "premium" if premium else "normal"
+
+
+class FileSink:
+	"""Write each rendered card to its own PNG file."""
+	def __init__(self, out_dir):
+		self.out_dir = out_dir
+		self.count = 0
+
+	def write(self, name, surface, card_id, locale, premium):
+		write_png(surface, self._path(name))
+		self.count += 1
+
+	def write_png(self, name, data, card_id, locale, premium):
+		with open(self._path(name), "wb") as f:
+			f.write(data)
+		self.count += 1
+
+	def link(self, name, target, card_id, locale, premium):
+		"""Hardlink a card to an identical one already written, returns
+		False when the file system does not support it."""
+		path = os.path.join(self.out_dir, name + ".png")
+		try:
+			if os.path.lexists(path):
+				os.remove(path)
+			os.link(os.path.join(self.out_dir, target + ".png"), path)
+		except OSError:
+			return False
+		self.count += 1
+		return True
+
+	def _path(self, name):
+		path = os.path.join(self.out_dir, name + ".png")
+		# don't write through a link from a previous deduplicated run
+		try:
+			if os.stat(path).st_nlink > 1:
+				os.remove(path)
+		except FileNotFoundError:
+			pass
+		return path
+
+	def close(self):
+		pass
+
+	def __str__(self):
+		return "{} files".format(self.count)
+
+
+class EncodedSink:
+	"""Keep rendered cards as encoded PNGs, to be passed to another sink
+	with write_png, e.g. from a worker process to the parent's sink."""
+	def __init__(self):
+		self.encoded = []
+
+	def write(self, name, surface, card_id, locale, premium):
+		buf = io.BytesIO()
+		write_png(surface, buf)
+		self.encoded.append((name, buf.getvalue(), card_id, locale, premium))
+
+	def take(self):
+		encoded, self.encoded = self.encoded, []
+		return encoded
+
+	def close(self):
+		pass
+
+
+class AtlasSink:
+	"""Pack rendered cards into fixed size sprite sheets.
+
+	Cards are placed left to right on shelves, a full sheet is written out
+	and released before the next one is started. The JSON index maps each
+	card id, locale and variant to a sheet and the rectangle within it.
+	"""
+	def __init__(self, out_dir, sheet_width, sheet_height, prefix="atlas"):
+		self.out_dir = out_dir
+		self.sheet_width = sheet_width
+		self.sheet_height = sheet_height
+		self.prefix = prefix
+		self.sheets = []
+		self.cards = {}
+		self._entries = {}
+		self._sheet = None
+		self._ctx = None
+		self._x, self._y, self._shelf = 0, 0, 0
+
+	def write(self, name, surface, card_id, locale, premium):
+		w, h = surface.get_width(), surface.get_height()
+		if w > self.sheet_width or h > self.sheet_height:
+			raise ValueError("Card {} ({}x{}) does not fit atlas sheet ({}x{})".format(
+				name, w, h, self.sheet_width, self.sheet_height))
+		# start a new shelf, then a new sheet, when the card doesn't fit
+		if self._sheet and self._x + w > self.sheet_width:
+			self._x, self._y, self._shelf = 0, self._y + self._shelf, 0
+		if self._sheet and self._y + h > self.sheet_height:
+			self._flush()
+		if not self._sheet:
+			self._new_sheet()
+		self._ctx.set_source_surface(surface, self._x, self._y)
+		self._ctx.rectangle(self._x, self._y, w, h)
+		self._ctx.fill()
+		entry = {
+			"sheet": len(self.sheets),
+			"x": self._x, "y": self._y, "width": w, "height": h
+		}
+		self._add_entry(name, entry, card_id, locale, premium)
+		self._x += w
+		self._shelf = max(self._shelf, h)
+
+	def write_png(self, name, data, card_id, locale, premium):
+		surface = cairo.ImageSurface.create_from_png(io.BytesIO(data))
+		self.write(name, surface, card_id, locale, premium)
+		surface.finish()
+
+	def link(self, name, target, card_id, locale, premium):
+		"""Index a card at the same rectangle as an identical one."""
+		if target not in self._entries:
+			return False
+		self._add_entry(name, self._entries[target], card_id, locale, premium)
+		return True
+
+	def close(self):
+		if self._sheet:
+			self._flush()
+		index = {
+			"sheets": self.sheets,
+			"cards": self.cards
+		}
+		with open(os.path.join(self.out_dir, ATLAS_INDEX), "w") as f:
+			json.dump(index, f, sort_keys=True)
+
+	def _add_entry(self, name, entry, card_id, locale, premium):
+		locales = self.cards.setdefault(card_id, {})
+		locales.setdefault(locale, {})[variant_name(premium)] = entry
+		self._entries[name] = entry
+
+	def _new_sheet(self):
+		self._sheet = cairo.ImageSurface(
+			cairo.FORMAT_ARGB32, self.sheet_width, self.sheet_height)
+		self._ctx = cairo.Context(self._sheet)
+		self._x, self._y, self._shelf = 0, 0, 0
+
+	def _flush(self):
+		filename = "{}_{:04d}.png".format(self.prefix, len(self.sheets))
+		self._sheet.flush()
+		write_png(self._sheet, os.path.join(self.out_dir, filename))
+		self.sheets.append({
+			"file": filename,
+			"width": self.sheet_width,
+			"height": self.sheet_height
+		})
+		# drop the sheet so only one is ever held in memory
+		self._ctx = None
+		self._sheet.finish()
+		self._sheet = None
+
+	def __str__(self):
+		return "{} cards in {} sheets".format(
+			sum(len(v) for l in self.cards.values() for v in l.values()),
+			len(self.sheets))
+
+
+class ArchiveSink:
+	"""Stream rendered cards into a zip or tar archive.
+
+	Cards are encoded to PNG on the render thread and queued to a single
+	writer thread, which appends them to the archive in order. PNGs are
+	already compressed so they are stored by default. The archive is closed
+	properly when the run is interrupted, for a hard kill a tar archive is
+	still readable up to the last member written, a zip is not.
+	"""
+	def __init__(self, path, format="zip", compression="store", max_queued=16):
+		if format == "zip":
+			if compression not in ZIP_COMPRESSION:
+				raise ValueError("Unknown zip compression '{}'".format(compression))
+			self._archive = zipfile.ZipFile(path, "w", ZIP_COMPRESSION[compression])
+			self._add = self._add_zip
+		elif format == "tar":
+			if compression not in TAR_COMPRESSION:
+				raise ValueError("Unknown tar compression '{}'".format(compression))
+			self._file = open(path, "wb")
+			self._archive = tarfile.open(
+				fileobj=self._file, mode="w|" + TAR_COMPRESSION[compression])
+			self._add = self._add_tar
+		else:
+			raise ValueError("Unknown archive format '{}'".format(format))
+		self.path = path
+		self.format = format
+		self.count = 0
+		self.bytes = 0
+		self._error = None
+		self._queue = queue.Queue(max_queued)
+		self._writer = threading.Thread(target=self._write_loop, daemon=True)
+		self._writer.start()
+
+	def write(self, name, surface, card_id, locale, premium):
+		if self._error:
+			raise self._error
+		buf = io.BytesIO()
+		write_png(surface, buf)
+		self.write_png(name, buf.getvalue(), card_id, locale, premium)
+
+	def write_png(self, name, data, card_id, locale, premium):
+		if self._error:
+			raise self._error
+		# blocks when the writer falls behind, bounding the memory used
+		self._queue.put((name + ".png", data))
+
+	def link(self, name, target, card_id, locale, premium):
+		"""Add a card as a hard link to an identical one, tar only."""
+		if self.format != "tar":
+			return False
+		if self._error:
+			raise self._error
+		self._queue.put((name + ".png", None, target + ".png"))
+		return True
+
+	def close(self):
+		if not self._writer.is_alive():
+			return
+		self._queue.put(None)
+		self._writer.join()
+		self._archive.close()
+		if self.format == "tar":
+			self._file.close()
+		if self._error:
+			raise self._error
+
+	def _write_loop(self):
+		while True:
+			item = self._queue.get()
+			if item is None:
+				break
+			if self._error:
+				continue
+			try:
+				self._add(*item)
+				self.count += 1
+				self.bytes += len(item[1] or b"")
+			except Exception as e:
+				self._error = e
+
+	def _add_zip(self, name, data):
+		info = zipfile.ZipInfo(name, time.localtime()[:6])
+		info.compress_type = self._archive.compression
+		self._archive.writestr(info, data)
+
+	def _add_tar(self, name, data, link=None):
+		info = tarfile.TarInfo(name)
+		info.mtime = time.time()
+		if link:
+			info.type = tarfile.LNKTYPE
+			info.linkname = link
+			self._archive.addfile(info)
+		else:
+			info.size = len(data)
+			self._archive.addfile(info, io.BytesIO(data))
+		self._file.flush()
+
+	def __str__(self):
+		return "{} files ({:.1f} MB) in {}".format(
+			self.count, self.bytes / 1024 / 1024, self.path)
+
+
+class DedupSink:
+	"""Store identical rendered cards once.
+
+	Each card is hashed, by its pixels or by its encoded PNG when it comes
+	from a worker, and only the first card with a hash is written to the
+	wrapped sink. The rest are linked to it where the sink supports that
+	(hardlinked files, tar links, atlas entries), in any case the index
+	written on close maps every output name to its content hash and each
+	hash to the name of the file holding it.
+	"""
+	def __init__(self, sink, out_dir):
+		self.sink = sink
+		self.out_dir = out_dir
+		self.outputs = {}
+		self.blobs = {}
+		self.linked = 0
+
+	def write(self, name, surface, card_id, locale, premium):
+		surface.flush()
+		digest = hashlib.sha1(surface.get_data())
+		digest.update("{}x{}".format(surface.get_width(), surface.get_height()).encode())
+		if not self._duplicate(name, "px:" + digest.hexdigest(), card_id, locale, premium):
+			self.sink.write(name, surface, card_id, locale, premium)
+
+	def write_png(self, name, data, card_id, locale, premium):
+		digest = "png:" + hashlib.sha1(data).hexdigest()
+		if not self._duplicate(name, digest, card_id, locale, premium):
+			self.sink.write_png(name, data, card_id, locale, premium)
+
+	def _duplicate(self, name, digest, card_id, locale, premium):
+		self.outputs[name] = digest
+		target = self.blobs.get(digest)
+		if target is None:
+			self.blobs[digest] = name
+			return False
+		link = getattr(self.sink, "link", None)
+		if link and link(name, target, card_id, locale, premium):
+			self.linked += 1
+		return True
+
+	def close(self):
+		self.sink.close()
+		index = {
+			"outputs": self.outputs,
+			"blobs": self.blobs
+		}
+		with open(os.path.join(self.out_dir, DEDUP_INDEX), "w") as f:
+			json.dump(index, f, indent=1, sort_keys=True)
+
+	def ratio(self):
+		"""The number of outputs per unique output."""
+		return len(self.outputs) / max(1, len(self.blobs))
+
+	def __str__(self):
+		return "{}, {} unique of {} cards (dedup ratio {:.2f}, {} linked)".format(
+			self.sink, len(self.blobs), len(self.outputs), self.ratio(), self.linked)
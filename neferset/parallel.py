@@ -0,0 +1,170 @@
+import os
+import resource
+import multiprocessing
+import multiprocessing.connection
+
+# tasks before a worker's RSS baseline is taken, the first few fill its caches
+WARMUP_TASKS = 10
+
+
+def memory_usage():
+	"""Current and peak RSS and the private (unshared) memory, in bytes.
+
+	Private memory is what a forked worker adds on top of the pages it
+	shares with its parent, it is 0 where /proc is not available.
+	"""
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+	usage = {"rss": peak, "peak": peak, "private": 0}
+	try:
+		with open("/proc/self/status") as f:
+			for line in f:
+				if line.startswith("VmRSS:"):
+					usage["rss"] = int(line.split()[1]) * 1024
+		with open("/proc/self/smaps_rollup") as f:
+			for line in f:
+				if line.startswith(("Private_Clean:", "Private_Dirty:")):
+					usage["private"] += int(line.split()[1]) * 1024
+	except OSError:
+		pass
+	return usage
+
+
+class WorkerStats:
+	"""Memory and task counts of each worker process."""
+	def __init__(self):
+		self.workers = {}
+		self.recycled = 0
+
+	def update(self, pid, usage):
+		stats = self.workers.setdefault(pid, {
+			"tasks": 0, "peak": 0, "private": 0, "base": 0, "rss": 0})
+		stats["tasks"] += 1
+		if stats["tasks"] == WARMUP_TASKS:
+			stats["base"] = usage["rss"]
+		stats["peak"] = max(stats["peak"], usage["peak"])
+		stats["private"] = max(stats["private"], usage["private"])
+		stats["rss"] = usage["rss"]
+
+	def growth(self, stats):
+		"""RSS growth per 1000 tasks, from the worker's baseline once it is warm
+		(after WARMUP_TASKS) to its last task, None until it is past that."""
+		if stats["tasks"] <= WARMUP_TASKS:
+			return None
+		return (stats["rss"] - stats["base"]) / (stats["tasks"] - WARMUP_TASKS) * 1000
+
+	def report(self):
+		lines = []
+		for pid, s in sorted(self.workers.items()):
+			growth = self.growth(s)
+			lines.append(
+				"Worker {}: {} tasks, peak RSS {:.1f} MB, private {:.1f} MB, "
+				"growth {} MB/1k cards".format(
+					pid, s["tasks"], s["peak"] / 1048576, s["private"] / 1048576,
+					"n/a" if growth is None else "{:.1f}".format(growth / 1048576)))
+		if self.recycled:
+			lines.append("Workers recycled: {}".format(self.recycled))
+		return lines
+
+
+def _worker(conn, task, state, max_tasks, max_rss):
+	"""Run tasks sent by the parent until told to stop, or until the task
+	or memory limit is reached, when it retires after sending its result."""
+	done = 0
+	while True:
+		item = conn.recv()
+		if item is None:
+			break
+		result, error = None, None
+		try:
+			result = task(state, item)
+		except Exception as e:
+			error = e
+		usage = memory_usage()
+		done += 1
+		retire = (max_tasks and done >= max_tasks) or (max_rss and usage["rss"] > max_rss)
+		conn.send((os.getpid(), result, error, usage, bool(retire)))
+		if retire:
+			break
+	conn.close()
+
+
+def fork_map(task, state, items, workers, stats=None, max_tasks=0, max_rss=0):
+	"""Run task(state, item) for each item in forked worker processes.
+
+	The state is warmed by the parent, the workers are forked after it is
+	set so they share its pages copy-on-write rather than loading their own.
+	Items are taken from the iterable one at a time, as workers go idle, so
+	at most one item per worker is in flight. Results are generated in
+	completion order, items must not be None.
+
+	A worker is replaced by a fresh fork of the parent once it has run
+	max_tasks items or its RSS is over max_rss bytes (0 for no limit), it
+	finishes its item first so no work is lost. An item whose worker dies
+	is retried once by another worker.
+	"""
+	ctx = multiprocessing.get_context("fork")
+	source = iter(items)
+	retry = []
+	retried = set()
+	running = {}
+
+	def take():
+		return retry.pop() if retry else next(source, None)
+
+	def start():
+		parent, child = ctx.Pipe()
+		proc = ctx.Process(
+			target=_worker, args=(child, task, state, max_tasks, max_rss), daemon=True)
+		proc.start()
+		child.close()
+		running[parent] = [proc, None]
+		return parent
+
+	def send(conn, item):
+		# None tells the worker to stop
+		running[conn][1] = item
+		conn.send(item)
+
+	try:
+		for _ in range(workers):
+			item = take()
+			if item is None:
+				break
+			send(start(), item)
+		while any(item is not None for _, item in running.values()):
+			for conn in multiprocessing.connection.wait(list(running)):
+				proc, item = running[conn]
+				try:
+					pid, result, error, usage, retire = conn.recv()
+				except EOFError:
+					del running[conn]
+					proc.join()
+					if item is None:
+						continue
+					if item in retried:
+						raise RuntimeError("Worker {} died on {!r} (exit code {})".format(
+							proc.pid, item, proc.exitcode))
+					retried.add(item)
+					send(start(), item)
+					continue
+				if error:
+					raise error
+				if stats:
+					stats.update(pid, usage)
+				if retire:
+					del running[conn]
+					proc.join()
+					if stats:
+						stats.recycled += 1
+					item = take()
+					if item is not None:
+						send(start(), item)
+				else:
+					send(conn, take())
+				yield result
+	finally:
+		for conn, (proc, item) in running.items():
+			if proc.is_alive():
+				proc.terminate()
+			proc.join()
+			conn.close()
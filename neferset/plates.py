@@ -0,0 +1,152 @@
+"""Description plates with the card's set watermark blended in.
+
+A plate is made from the plate recipe of a watermark layer (see
+custom.resolve) and the theme files, so a rasterizer can make the plates
+it needs from a plan. Plates are cached as PNGs in the cache dir, named by
+theme and recipe.
+"""
+
+import os
+import os.path
+from .geometry import Vector4
+from .assets import exists
+from . import metrics
+
+CACHE_DIR = ".cache" # store generated images here for reuse
+ICON_EXT = ".png" # set icon file extension
+# plate paths already made or found, by (theme dir, plate name)
+PATHS = {}
+
+# optional dependency, only imported by the functions that use it
+ImagePIL = None
+
+
+def load_pil():
+	global ImagePIL
+	if not ImagePIL:
+		from PIL import Image
+		ImagePIL = Image
+
+
+def rgb_to_bytes(color):
+	"""Convert from fractional rgb values to a tuple of byte values."""
+	return tuple(int(round(i * 255)) for i in color)
+
+
+def rgb_from_bytes(color):
+	"""Convert from byte rgb values to a Vector4 of fractional values."""
+	return Vector4(*[i / 255 for i in color])
+
+
+def blend_watermark(icon, base, tint, intensity):
+	"""Blend a tinted set icon into the base plate, both sequences of byte
+	RGBA pixels, returns the list of blended pixels.
+
+	Each pixel is base * icon - base, scaled by the icon alpha and added to
+	the base. The math is unrolled over plain floats rather than Vector4s,
+	as this runs for every pixel of every plate.
+	"""
+	tr, tg, tb, ta = tint
+	out = []
+	append = out.append
+	for (ir, ig, ib, ia), (br, bg, bb, ba) in zip(icon, base):
+		# speed up by ignoring fully transparent pixels on the set icon
+		if ia == 0:
+			append(rgb_to_bytes((br / 255, bg / 255, bb / 255, ba / 255)))
+			continue
+		r = ir / 255 * tr * intensity
+		g = ig / 255 * tg * intensity
+		b = ib / 255 * tb * intensity
+		a = ia / 255 * ta * intensity
+		br, bg, bb = br / 255, bg / 255, bb / 255
+		append((
+			int(round(((br * r - br) * a + br) * 255)),
+			int(round(((bg * g - bg) * a + bg) * 255)),
+			int(round(((bb * b - bb) * a + bb) * 255)),
+			255))
+	return out
+
+
+def plate_prefix(theme_dir):
+	"""Plates of all themes share the cache dir, each is named for its theme."""
+	return os.path.basename(os.path.normpath(theme_dir)) + "_"
+
+
+def plate_path(theme_dir, layer, cache_dir=CACHE_DIR):
+	"""Get the path of the plate a watermark layer draws, creating and
+	caching it when required, None when the set icon is missing."""
+	plate = layer.get("plate")
+	# no icon for core set, but need description plate
+	if not plate:
+		return os.path.join(theme_dir, layer["base"])
+	key = (theme_dir, plate["name"])
+	if key in PATHS:
+		metrics.cache("watermarks", True)
+		return PATHS[key]
+	image_path = os.path.join(
+		cache_dir, "{}{}.png".format(plate_prefix(theme_dir), plate["name"]))
+	# if there is a cached version of the image use it
+	if os.path.isfile(image_path):
+		metrics.cache("watermarks", True)
+		PATHS[key] = image_path
+		return image_path
+
+	# check the set icon exists
+	set_icon_path = os.path.join(theme_dir, plate["icon"])
+	if not exists(set_icon_path):
+		print("Warning: set icon missing ({})".format(set_icon_path))
+		return None
+	load_pil()
+	os.makedirs(cache_dir, exist_ok=True)
+
+	# resize the set icon to the correct size and offset it within the base
+	set_org = ImagePIL.open(set_icon_path)
+	set_resize = set_org.resize(tuple(plate["size"]), ImagePIL.BILINEAR)
+	set_img = ImagePIL.new("RGBA", (layer["width"], layer["height"]), (0, 0, 0, 0))
+	set_img.paste(set_resize, tuple(plate["offset"]))
+	set_org.close()
+	set_resize.close()
+
+	# open the base image
+	descp_img = ImagePIL.open(os.path.join(theme_dir, layer["base"]))
+	r0_data = set_img.getdata()
+	r1_data = descp_img.getdata()
+
+	# check nothing strange happened
+	assert len(r0_data) == descp_img.width * descp_img.height, "data size mismatch"
+
+	out_data = blend_watermark(
+		r0_data, r1_data, Vector4(*plate["tint"]), plate["intensity"])
+
+	out = ImagePIL.new("RGBA", (descp_img.width, descp_img.height))
+	out.putdata(out_data)
+	out.save(image_path)
+	metrics.cache("watermarks", False)
+
+	out.close()
+	descp_img.close()
+	set_img.close()
+	PATHS[key] = image_path
+	return image_path
+
+
+
+def clear_plates(theme_dir, cache_dir=CACHE_DIR):
+	"""Drop the plates of a theme, so they are made again from its current
+	files, the plates of other themes are kept. Returns the paths dropped."""
+	theme_dir = os.path.normpath(theme_dir)
+	prefix = plate_prefix(theme_dir)
+	# a theme named with this one's prefix, e.g. default_dark for default
+	parent = os.path.dirname(theme_dir) or "."
+	others = [plate_prefix(name) for name in os.listdir(parent)
+		if name.startswith(prefix) and os.path.isdir(os.path.join(parent, name))]
+	dropped = [PATHS.pop(k) for k in list(PATHS) if os.path.normpath(k[0]) == theme_dir]
+	if os.path.isdir(cache_dir):
+		for name in os.listdir(cache_dir):
+			if (name.startswith(prefix) and name.endswith(".png")
+					and not name.startswith(tuple(others))):
+				path = os.path.join(cache_dir, name)
+				os.remove(path)
+				if path not in dropped:
+					dropped.append(path)
+	return dropped
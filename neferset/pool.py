@@ -0,0 +1,49 @@
+import cairo
+
+
+class SurfacePool:
+	"""Reusable cairo image surfaces, keyed by their pixel dimensions.
+
+	Surfaces are handed out by acquire and returned with release, a returned
+	surface is cleared to transparent before it is reused.
+	"""
+	def __init__(self, max_free=2):
+		self.max_free = max_free
+		self._free = {}
+		self.created = 0
+		self.reused = 0
+
+	def acquire(self, width, height):
+		free = self._free.get((width, height))
+		if free:
+			surface = free.pop()
+			self._clear(surface)
+			self.reused += 1
+		else:
+			surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+			self.created += 1
+		return surface
+
+	def release(self, surface):
+		key = (surface.get_width(), surface.get_height())
+		free = self._free.setdefault(key, [])
+		if len(free) < self.max_free:
+			free.append(surface)
+		else:
+			surface.finish()
+
+	def clear(self):
+		"""Release the memory held by all pooled surfaces."""
+		for free in self._free.values():
+			for surface in free:
+				surface.finish()
+		self._free = {}
+
+	def _clear(self, surface):
+		ctx = cairo.Context(surface)
+		ctx.set_operator(cairo.OPERATOR_CLEAR)
+		ctx.paint()
+		surface.flush()
+
+	def __str__(self):
+		return "{} created, {} reused".format(self.created, self.reused)
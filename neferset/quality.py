@@ -0,0 +1,59 @@
+import cairo
+
+
+class Preset:
+	"""Render settings trading quality for speed.
+
+	antialias -- text antialiasing (cairo.ANTIALIAS_*)
+	hint_style -- text hinting (cairo.HINT_STYLE_*)
+	shape_antialias -- antialiasing of paths, e.g. outlines and clips
+	filter -- the pattern filter used when scaling images (cairo.FILTER_*)
+	curve_segments -- samples used to estimate the arc length of text curves
+	png_level -- zlib compression level of the PNGs, None for cairo's default
+	"""
+	def __init__(self, name, antialias, hint_style, shape_antialias, filter,
+			curve_segments, png_level):
+		self.name = name
+		self.antialias = antialias
+		self.hint_style = hint_style
+		self.shape_antialias = shape_antialias
+		self.filter = filter
+		self.curve_segments = curve_segments
+		self.png_level = png_level
+
+	def font_options(self):
+		fo = cairo.FontOptions()
+		fo.set_antialias(self.antialias)
+		fo.set_hint_style(self.hint_style)
+		return fo
+
+	def __str__(self):
+		return self.name
+
+
+PRESETS = {
+	# quick previews and layout review
+	"draft": Preset(
+		"draft", cairo.ANTIALIAS_FAST, cairo.HINT_STYLE_NONE, cairo.ANTIALIAS_FAST,
+		cairo.FILTER_FAST, 25, 1),
+	# the previous fixed settings
+	"normal": Preset(
+		"normal", cairo.ANTIALIAS_SUBPIXEL, cairo.HINT_STYLE_DEFAULT,
+		cairo.ANTIALIAS_DEFAULT, cairo.FILTER_GOOD, 100, None),
+	# published cards
+	"release": Preset(
+		"release", cairo.ANTIALIAS_BEST, cairo.HINT_STYLE_NONE, cairo.ANTIALIAS_BEST,
+		cairo.FILTER_BEST, 200, 9),
+}
+
+# the preset used by the drawing functions
+current = PRESETS["normal"]
+
+
+def set_quality(name):
+	global current
+	if name not in PRESETS:
+		raise ValueError("Unknown quality '{}', use one of {}".format(
+			name, ", ".join(PRESETS)))
+	current = PRESETS[name]
+	return current
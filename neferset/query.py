@@ -0,0 +1,173 @@
+import re
+import fnmatch
+from hearthstone.enums import (
+	CardSet, CardClass, CardType, Rarity, Race, MultiClassGroup
+)
+
+# query field name -> (card attribute, value type)
+FIELDS = {
+	"set": ("card_set", CardSet),
+	"class": ("card_class", CardClass),
+	"type": ("type", CardType),
+	"rarity": ("rarity", Rarity),
+	"cost": ("cost", int),
+	"race": ("race", Race),
+	"multiclass": ("multi_class_group", MultiClassGroup),
+	"collectible": ("collectible", bool),
+}
+ID_FIELD = "id"
+TOKEN_RE = re.compile(r"\s*(?:(<=|>=|!=|==|=|<|>)|([(),])|([^\s(),<>=!]+))")
+
+
+def tokenize(text):
+	tokens = []
+	pos = 0
+	text = text.strip()
+	while pos < len(text):
+		match = TOKEN_RE.match(text, pos)
+		if not match or match.end() == pos:
+			raise ValueError("Invalid query at '{}'".format(text[pos:]))
+		tokens.append(match.group(match.lastindex))
+		pos = match.end()
+	return tokens
+
+
+def parse_value(field, value):
+	"""Convert a query value string to the type of the indexed field."""
+	vtype = FIELDS[field][1]
+	try:
+		if vtype is int:
+			return int(value)
+		elif vtype is bool:
+			if value.lower() not in ("true", "false", "1", "0"):
+				raise ValueError
+			return value.lower() in ("true", "1")
+		return vtype[value.upper()]
+	except (KeyError, ValueError):
+		raise ValueError("Invalid value '{}' for '{}'".format(value, field))
+
+
+class CardIndex:
+	"""Indexes of card ids by the card attributes used for selection.
+
+	Queries are boolean expressions of field comparisons, e.g.
+		set in (EXPERT1, NAXX) and type=MINION and cost>=7
+		class=MAGE or id=EX1_*
+	they are evaluated as set operations on the indexes.
+	"""
+	def __init__(self, db):
+		self.db = db
+		self.all = frozenset(db.keys())
+		self.indexes = {f: {} for f in FIELDS}
+		for id, card in db.items():
+			for field, (attr, _) in FIELDS.items():
+				value = getattr(card, attr)
+				self.indexes[field].setdefault(value, set()).add(id)
+
+	def lookup(self, field, value):
+		return self.indexes[field].get(value, set())
+
+	def query(self, text):
+		"""Get the set of card ids matching a query expression."""
+		parser = _Parser(self, tokenize(text))
+		ids = parser.expression()
+		if parser.peek() is not None:
+			raise ValueError("Unexpected '{}' in query".format(parser.peek()))
+		# don't hand out the index sets themselves
+		return set(ids)
+
+	def select(self, ids):
+		"""Generate the cards for a set of ids, in id order."""
+		for id in sorted(ids):
+			yield self.db[id]
+
+
+class _Parser:
+	def __init__(self, index, tokens):
+		self.index = index
+		self.tokens = tokens
+		self.pos = 0
+
+	def peek(self):
+		return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+	def next(self):
+		token = self.peek()
+		if token is None:
+			raise ValueError("Unexpected end of query")
+		self.pos += 1
+		return token
+
+	def accept(self, word):
+		token = self.peek()
+		if token is not None and token.lower() == word:
+			self.pos += 1
+			return True
+		return False
+
+	def expect(self, word):
+		if not self.accept(word):
+			raise ValueError("Expected '{}' in query, found '{}'".format(word, self.peek()))
+
+	def expression(self):
+		ids = self.conjunction()
+		while self.accept("or"):
+			ids = ids | self.conjunction()
+		return ids
+
+	def conjunction(self):
+		ids = self.negation()
+		while self.accept("and"):
+			ids = ids & self.negation()
+		return ids
+
+	def negation(self):
+		if self.accept("not"):
+			return self.index.all - self.negation()
+		if self.accept("("):
+			ids = self.expression()
+			self.expect(")")
+			return ids
+		return self.comparison()
+
+	def comparison(self):
+		field = self.next().lower()
+		if field not in FIELDS and field != ID_FIELD:
+			raise ValueError("Unknown query field '{}'".format(field))
+		if self.accept("in"):
+			self.expect("(")
+			values = [self.next()]
+			while self.accept(","):
+				values.append(self.next())
+			self.expect(")")
+			ids = set()
+			for v in values:
+				ids |= self.match(field, "=", v)
+			return ids
+		op = self.next()
+		if op not in ("=", "==", "!=", "<", "<=", ">", ">="):
+			raise ValueError("Unknown query operator '{}'".format(op))
+		return self.match(field, op, self.next())
+
+	def match(self, field, op, value):
+		if field == ID_FIELD:
+			if op not in ("=", "==", "!="):
+				raise ValueError("Card ids only support '=' and '!='")
+			ids = set(fnmatch.filter(self.index.all, value))
+		elif op in ("=", "==", "!="):
+			ids = self.index.lookup(field, parse_value(field, value))
+		elif FIELDS[field][1] is int:
+			target = parse_value(field, value)
+			compare = {
+				"<": int.__lt__, "<=": int.__le__,
+				">": int.__gt__, ">=": int.__ge__
+			}[op]
+			ids = set()
+			for key, key_ids in self.index.indexes[field].items():
+				if key is not None and compare(key, target):
+					ids |= key_ids
+		else:
+			raise ValueError("'{}' only supports '=' and '!='".format(field))
+		if op == "!=":
+			return self.index.all - ids
+		return ids
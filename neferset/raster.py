@@ -0,0 +1,293 @@
+"""Draw render plans, the second stage of rendering a card.
+
+A plan is the card data resolved against a theme (see generate.plan_card),
+a JSON object of the components to draw with their final text, asset keys,
+artwork and custom drawing. Drawing a plan only needs the theme, the asset
+files and the artwork, not the card database or the hearthstone library,
+so this module can be run on its own:
+
+	python -m neferset.raster plans.jsonl --out-dir out --workers 4
+"""
+
+import os
+import os.path
+import sys
+import json
+import time
+import cairo
+from .component import ComponentType, ComponentData
+from .curved import curved_text
+from .theme import ThemeError
+from .drawing import (
+	draw_png_asset, draw_surface_at, text, text_block, text_sprite, polygon,
+	load_rsvg
+)
+from . import quality, metrics, plates, drawing
+
+MIN_WIDTH = 128
+# numbers drawn from pre-rendered sprites, see drawing.text_sprite
+STAT_TYPES = (ComponentType.cost, ComponentType.attack, ComponentType.health)
+
+# decoded images and parsed svgs used by custom layers, by path
+IMAGES = {}
+SVGS = {}
+
+
+def draw_clip_region(ctx, obj):
+	if obj.path:
+		ctx.append_path(obj.path)
+	else:
+		polygon(ctx, obj.points, False, 0.01)
+
+
+def text_case(case, text):
+	if case == "upper":
+		return text.upper()
+	elif case == "lower":
+		return text.lower()
+	return text
+
+
+def image_surface(path):
+	"""Get a decoded image used by custom layers, they are shared by many cards."""
+	if path not in IMAGES:
+		IMAGES[path] = cairo.ImageSurface.create_from_png(path)
+	return IMAGES[path]
+
+
+def svg_tree(path):
+	"""Get a parsed svg used by custom layers, its fill is set when drawn."""
+	load_rsvg()
+	metrics.cache("svgs", path in SVGS)
+	if path not in SVGS:
+		SVGS[path] = drawing.etree.parse(path)
+	return SVGS[path]
+
+
+def draw_resolved(ctx, layer, theme_dir):
+	"""Draw a custom component resolved for a card, see custom.resolve, its
+	files are relative to the theme dir."""
+	if layer["draw"] == "watermark":
+		path = plates.plate_path(theme_dir, layer)
+		if path:
+			draw_surface_at(
+				ctx, image_surface(path), layer["x"], layer["y"],
+				layer["width"], layer["height"])
+	elif layer["draw"] == "svg":
+		tree = svg_tree(os.path.join(theme_dir, layer["file"]))
+		tree.getroot().attrib["fill"] = layer["fill"]
+		ctx.save()
+		ctx.new_path()
+		ctx.translate(layer["x"], layer["y"])
+		ctx.scale(layer["scale"], layer["scale"])
+		handle = drawing.Rsvg.Handle.new()
+		handle.write(drawing.etree.tostring(tree))
+		handle.close()
+		drawing.Rsvg.Handle.render_cairo(handle, ctx)
+		ctx.restore()
+
+
+def render_component(
+		context, art_dir, theme, loc_code, component, data, art_store=None,
+		theme_dir=None):
+	clipped = False
+	# first check if there is a clipping region
+	if component.clip:
+		draw_clip_region(context, component.clip)
+		context.clip()
+		clipped = True
+	# draw image
+	if component.image and data.override:
+		draw_png_asset(context, component.image, art_dir, data.override, art_store, "art")
+		if clipped:
+			context.reset_clip()
+			clipped = False
+	elif component.image and data.key in component.image.assets:
+		draw_png_asset(context, component.image, theme.dir, data.key, theme)
+		if clipped:
+			context.reset_clip()
+			clipped = False
+	# draw text, the case is already applied by the plan
+	if component.text and component.font and data.text:
+		if component.font.type == "textBlock":
+			text_block(context, component.text, data.text, component.font, loc_code)
+		elif component.type in STAT_TYPES and data.text.isdigit():
+			text_sprite(context, component.text, data.text, component.font, loc_code)
+		else:
+			text(context, component.text, data.text, component.font, loc_code)
+	# draw curved text if any
+	if component.curve and component.font and data.text:
+		curved_text(context, component.curve, data.text, component.font)
+	# custom drawing, resolved when the plan was made
+	if component.custom and data.obj:
+		draw_resolved(context, data.obj, theme_dir or theme.dir)
+
+
+def output_scale(width, out_width):
+	"""The scale from theme units to output pixels."""
+	if out_width >= MIN_WIDTH:
+		return out_width / width
+	return 1
+
+
+def setup_context(width, height, out_width=0, pool=None):
+	scale = output_scale(width, out_width)
+	size = (int(round(width * scale)), int(round(height * scale)))
+	if pool:
+		# pooled surfaces are already cleared to transparent
+		surface = pool.acquire(*size)
+	else:
+		surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, *size)
+	ctx = cairo.Context(surface)
+	ctx.set_antialias(quality.current.shape_antialias)
+	ctx.scale(scale, scale)
+	ctx.set_source_rgba(0, 0, 0, 0) # transparent bg
+	ctx.paint()
+	return (ctx, surface)
+
+
+def rasterize(plan, theme, art_dir, sink, pool=None, art_store=None, theme_dir=None):
+	"""Draw a plan and write it to the sink, returns the output name, or
+	None when no component is drawn. The files of custom layers are found in
+	theme_dir, the theme's own dir by default."""
+	components = theme.components(plan["type"])
+	if components is None:
+		metrics.outcome("unsupported", plan["type"])
+		return None
+	if not plan["layers"]:
+		metrics.outcome("skipped", "nothing drawn")
+		return None
+	start = time.perf_counter()
+	by_name = {c.name: c for c in components}
+
+	ctx, surface = setup_context(theme.width, theme.height, plan["width"], pool)
+	for layer in plan["layers"]:
+		c = by_name.get(layer["component"])
+		if not c:
+			print("{} : no '{}' component in '{}' theme".format(
+				plan["card"], layer["component"], theme.name))
+			continue
+		data = ComponentData(
+			layer.get("key", "default"), layer.get("text"), layer.get("art"),
+			layer.get("custom"))
+		render_component(ctx, art_dir, theme, plan["lang"], c, data, art_store, theme_dir)
+	surface.flush()
+	drawn = time.perf_counter()
+	metrics.stage("draw", drawn - start)
+	sink.write(plan["name"], surface, plan["card"], plan["locale"], plan["premium"])
+	metrics.stage("write", time.perf_counter() - drawn)
+	# hand the surface back for the next card, drop the context first
+	del ctx
+	if pool:
+		pool.release(surface)
+	return plan["name"]
+
+
+def read_plans(path):
+	"""Generate the lines of a JSON lines plans file, '-' for stdin, they
+	are parsed by plan_task."""
+	f = sys.stdin if path == "-" else open(path)
+	try:
+		for line in f:
+			line = line.strip()
+			if line:
+				yield line
+	finally:
+		if f is not sys.stdin:
+			f.close()
+
+
+def load_style(state, style):
+	"""The theme of a style, compiled and validated on first use, or the
+	bundle when set."""
+	from .theme import compile_theme
+	key = None if state["bundle"] else style
+	themes = state["themes"]
+	if key not in themes:
+		theme = compile_theme(os.path.join(state["asset_dir"], style), state["font_map"])
+		theme.validate()
+		themes[key] = theme
+	return themes[key]
+
+
+def plan_task(state, line):
+	"""Rasterize a plan, in this process or a forked worker, errors are
+	returned rather than raised so the other plans are still drawn."""
+	plan = {}
+	try:
+		plan = json.loads(line)
+		theme = load_style(state, plan["style"])
+		# plans for several styles are named with a dir per style
+		sub_dir = os.path.dirname(plan["name"])
+		if sub_dir:
+			os.makedirs(os.path.join(state["sink"].out_dir, sub_dir), exist_ok=True)
+		# the plan's paths are relative, found in this host's styles
+		name = rasterize(
+			plan, theme, state["art_dir"], state["sink"], state["pool"], state["store"],
+			os.path.join(state["asset_dir"], plan["style"]))
+		return (plan["card"], name, None)
+	except ThemeError:
+		# a broken style fails every plan, stop rather than report each
+		raise
+	except Exception as e:
+		return (plan.get("card"), None, "{}: {}".format(type(e).__name__, e))
+
+
+def rasterize_plans(
+		plans="-", art_dir="./art", out_dir="./out", asset_dir="./assets/styles",
+		bundle=None, fonts=None, art_store=None, workers=1, quality="normal"):
+	"""Draw the cards of a render plans file (see generate prepare).
+
+	-- plans	the JSON lines plans file, '-' to read from stdin
+	-- art_dir	location of the card artwork files
+	-- out_dir	location to save the cards
+	-- asset_dir	location of the HearthForge styles the plans use
+	-- bundle	use a compiled theme bundle rather than the style
+	-- fonts	override the fonts, semi-colon separated 'old=new' pairs
+	-- art_store	use pre-decoded artwork from this dir
+	-- workers	the number of worker processes to draw with
+	-- quality	'draft', 'normal' or 'release' render settings
+	"""
+	from .artstore import ArtStore
+	from .theme import load_bundle
+	from .output import FileSink
+	from .parallel import fork_map
+	from .pool import SurfacePool
+	from . import quality as presets
+	start = time.perf_counter()
+	presets.set_quality(quality)
+	os.makedirs(out_dir, exist_ok=True)
+	state = {
+		"themes": {}, "asset_dir": asset_dir, "bundle": bundle,
+		"font_map": dict(f.split("=") for f in fonts.split(";")) if fonts else None,
+		"art_dir": art_dir, "sink": FileSink(out_dir), "pool": SurfacePool(),
+		"store": ArtStore(art_store, art_dir) if art_store else None
+	}
+	if bundle:
+		state["themes"][None] = load_bundle(bundle, state["font_map"])
+		state["themes"][None].validate()
+		if workers > 1:
+			# decoded before forking, so the workers share it
+			state["themes"][None].decode_assets()
+			state["themes"][None].warm_surfaces()
+	if workers > 1:
+		results = fork_map(plan_task, state, read_plans(plans), workers)
+	else:
+		results = (plan_task(state, p) for p in read_plans(plans))
+	drawn, failed = 0, 0
+	for card_id, name, error in results:
+		if error:
+			print("{} failed: {}".format(card_id, error))
+			failed += 1
+		elif name:
+			drawn += 1
+	state["pool"].clear()
+	if state["store"]:
+		state["store"].clear()
+	print("Rasterized {} cards, {} failed in {:.2f}s".format(
+		drawn, failed, time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+	import fire
+	fire.Fire(rasterize_plans)
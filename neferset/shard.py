@@ -0,0 +1,140 @@
+import os
+import os.path
+import json
+import glob
+import hashlib
+import heapq
+
+MANIFEST_FMT = "manifest_{}_{}.json"
+
+
+def parse_shard(text):
+	"""Parse a shard specification 'i/N', with i from 0 to N - 1."""
+	try:
+		index, count = (int(x) for x in str(text).split("/"))
+	except ValueError:
+		raise ValueError("Invalid shard '{}', expected 'i/N'".format(text))
+	if count < 1 or index < 0 or index >= count:
+		raise ValueError("Invalid shard '{}', i must be in 0..N-1".format(text))
+	return (index, count)
+
+
+def stable_hash(text):
+	"""A hash that is the same in every process and on every host."""
+	return int.from_bytes(hashlib.md5(text.encode("utf-8")).digest()[:8], "little")
+
+
+def assign_shards(cards, count, cost):
+	"""Divide cards between count shards, balanced by their estimated cost.
+
+	Cards are placed largest first on the least loaded shard, ties are broken
+	by a stable hash of the id, so every node computes the same assignment.
+	Returns a list of card lists, one per shard.
+	"""
+	ordered = sorted(cards, key=lambda c: (-cost(c), stable_hash(c.id), c.id))
+	loads = [(0.0, i) for i in range(count)]
+	shards = [[] for _ in range(count)]
+	for card in ordered:
+		load, i = heapq.heappop(loads)
+		shards[i].append(card)
+		heapq.heappush(loads, (load + cost(card), i))
+	return shards
+
+
+def write_manifest(out_dir, index, count, total, selected, outputs, skipped, failed=()):
+	"""Write the partial manifest of what a shard rendered.
+
+	outputs -- a dict of output name to card id
+	skipped -- card ids without output, e.g. unsupported by the theme
+	failed -- card ids with a render that raised an error
+	"""
+	manifest = {
+		"shard": index,
+		"count": count,
+		"total": total,
+		"selected": sorted(selected),
+		"outputs": outputs,
+		"skipped": sorted(skipped),
+		"failed": sorted(failed)
+	}
+	path = os.path.join(out_dir, MANIFEST_FMT.format(index, count))
+	with open(path, "w") as f:
+		json.dump(manifest, f, indent=1)
+	return path
+
+
+def find_manifests(paths):
+	"""Expand directories into the shard manifests they contain."""
+	files = []
+	for path in paths:
+		if os.path.isdir(path):
+			files.extend(sorted(glob.glob(os.path.join(path, MANIFEST_FMT.format("*", "*")))))
+		else:
+			files.append(path)
+	return files
+
+
+def merge_manifests(files):
+	"""Check the coverage of a set of shard manifests.
+
+	Returns the merged manifest and a list of the problems found, e.g.
+	missing shards, cards selected by no shard or several, cards that
+	failed and cards without an output (neither written nor skipped as
+	unsupported).
+	"""
+	manifests = []
+	for file in files:
+		with open(file) as f:
+			manifests.append(json.load(f))
+	problems = []
+	if not manifests:
+		return ({}, ["No manifests found"])
+	counts = set(m["count"] for m in manifests)
+	totals = set(m["total"] for m in manifests)
+	if len(counts) > 1 or len(totals) > 1:
+		problems.append("Manifests are from different runs (count {}, total {})".format(
+			sorted(counts), sorted(totals)))
+	count = max(counts)
+	shards = {}
+	for m in manifests:
+		if m["shard"] in shards:
+			problems.append("Shard {} has several manifests".format(m["shard"]))
+		shards[m["shard"]] = m
+	for i in range(count):
+		if i not in shards:
+			problems.append("Shard {}/{} manifest is missing".format(i, count))
+
+	selected, outputs, rendered = {}, {}, {}
+	skipped, failed = set(), {}
+	for m in manifests:
+		for id in m["selected"]:
+			selected.setdefault(id, []).append(m["shard"])
+		for name, id in m["outputs"].items():
+			outputs.setdefault(name, []).append(m["shard"])
+			rendered[name] = id
+		skipped.update(m["skipped"])
+		for id in m.get("failed", []):
+			failed.setdefault(id, []).append(m["shard"])
+	for id, where in sorted(selected.items()):
+		if len(where) > 1:
+			problems.append("Card {} selected by shards {}".format(id, where))
+	for name, where in sorted(outputs.items()):
+		if len(where) > 1:
+			problems.append("Output {} duplicated in shards {}".format(name, where))
+	for id, where in sorted(failed.items()):
+		problems.append("Card {} failed to render in shards {}".format(id, where))
+	for id in sorted(set(selected) - set(rendered.values()) - skipped - set(failed)):
+		problems.append("Card {} has no output".format(id))
+	total = max(totals)
+	if len(selected) != total:
+		problems.append("{} of {} cards selected across shards".format(len(selected), total))
+
+	merged = {
+		"count": count,
+		"total": total,
+		"selected": sorted(selected),
+		"outputs": rendered,
+		"skipped": sorted(skipped),
+		"failed": sorted(failed)
+	}
+	return (merged, problems)
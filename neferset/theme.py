@@ -0,0 +1,331 @@
+import os
+import os.path
+import json
+import math
+import pickle
+import cairo
+from operator import attrgetter
+from .component import ComponentType, Component
+from .curved import CubicBezier
+from .drawing import polygon_path, draw_surface_at
+from .quality import PRESETS
+
+THEME_JSON = "data.json"
+BUNDLE_VERSION = 4
+# component types drawn for every card, with the default asset
+ALWAYS_DRAWN = (ComponentType.base, ComponentType.unknown)
+
+
+class ThemeError(Exception):
+	"""A theme failed validation, errors lists every problem found."""
+	def __init__(self, name, errors):
+		# the args are kept as given, so it pickles, e.g. from a worker
+		super().__init__(name, errors)
+		self.name = name
+		self.errors = errors
+
+	def __str__(self):
+		return "Theme '{}' has {} errors:\n{}".format(
+			self.name, len(self.errors), "\n".join(self.errors))
+
+
+def component_type(name):
+	try:
+		return ComponentType[name]
+	except KeyError:
+		return ComponentType.unknown
+
+
+def theme_components(data, font_map=None):
+	"""Get all the components of a card type, sorted by the layer attribute."""
+	components = []
+	for k, v in data.items():
+		components.append(Component(v, component_type(k), font_map, k))
+	components.sort(key=attrgetter("layer"))
+	return components
+
+
+def card_types(data):
+	"""The card type names in theme data (e.g. 'minion', 'spell_premium')."""
+	return set(k for k, v in data.items() if isinstance(v, dict))
+
+
+def load_theme_json(theme_dir):
+	if not os.path.isdir(theme_dir):
+		raise FileNotFoundError("Asset dir not found ({})".format(theme_dir))
+	with open(os.path.join(theme_dir, THEME_JSON)) as f:
+		return json.load(f)
+
+
+class Theme:
+	"""A HearthForge theme, with everything needed to render resolved.
+
+	Components are created and layer sorted per card type, their asset paths
+	resolved and checked and the arc length tables of text curves computed.
+	Problems are collected in errors, rather than found mid render.
+	"""
+	def __init__(self, theme_dir, data, font_map=None):
+		self.dir = theme_dir
+		self.font_map = font_map
+		self.decoded = {}
+		self.culled = []
+		self.cull_margin = None
+		self._surfaces = {}
+		self.compile(data)
+
+	@property
+	def name(self):
+		return self.data.get("name")
+
+	def compile(self, data):
+		"""(Re)compile the theme from its json data."""
+		self.data = data
+		self.width = data.get("width")
+		self.height = data.get("height")
+		self.errors = []
+		self.card_types = {}
+		if not self.width or not self.height:
+			self.errors.append("width and height are required")
+		for ctype in sorted(card_types(data)):
+			try:
+				components = theme_components(data[ctype], self.font_map)
+			except (KeyError, ValueError, TypeError) as e:
+				self.errors.append("{}: invalid component ({!r})".format(ctype, e))
+				continue
+			for c in components:
+				self._resolve(ctype, c)
+			self.card_types[ctype] = components
+		self._surfaces = {}
+		self.culled = []
+		self._compile_clips()
+		if self.cull_margin is not None:
+			self.cull(self.cull_margin)
+
+	def _compile_clips(self):
+		for components in self.card_types.values():
+			for c in components:
+				if c.clip and c.clip.points:
+					c.clip.path = polygon_path(c.clip.points)
+
+	def _resolve(self, ctype, c):
+		where = "{}.{}".format(ctype, c.name)
+		if c.image:
+			for key, file in c.image.assets.items():
+				path = os.path.normpath(os.path.join(self.dir, file))
+				if os.path.isfile(path):
+					c.image.paths[key] = path
+				else:
+					self.errors.append("{}: asset '{}' not found ({})".format(where, key, path))
+		if (c.text or c.curve) and not c.font:
+			self.errors.append("{}: text without a font".format(where))
+		if c.font and (not c.font.family or not c.font.size or not c.font.color):
+			self.errors.append("{}: font needs family, size and color".format(where))
+		if c.curve:
+			# a table per preset, so a bundle suits any --quality
+			for segments in set(p.curve_segments for p in PRESETS.values()):
+				bezier = CubicBezier(
+					c.curve.start.x, c.curve.start.y, c.curve.c1.x, c.curve.c1.y,
+					c.curve.c2.x, c.curve.c2.y, c.curve.end.x, c.curve.end.y)
+				length = bezier.estimate_length(segments)
+				c.curve.tables[segments] = (bezier.arc_lengths, length)
+		if c.custom:
+			if "name" not in c.custom:
+				self.errors.append("{}: custom component without a name".format(where))
+			img = c.custom.get("image")
+			for file in (img or {}).get("assets", {}).values():
+				if not os.path.isfile(os.path.join(self.dir, file)):
+					self.errors.append("{}: custom asset not found ({})".format(where, file))
+			icons = c.custom.get("setIcons")
+			if icons and not os.path.isdir(os.path.join(self.dir, icons)):
+				self.errors.append("{}: set icon dir not found ({})".format(where, icons))
+
+	def cull(self, margin=2):
+		"""Remove components that are always hidden by later opaque layers.
+
+		The opaque coverage of each always drawn, unclipped image is painted
+		into a mask at theme size, a component is culled when its extent, plus
+		a margin for scaling, is fully covered by the layers above it.
+		Returns the list of culled components, also kept in culled.
+		"""
+		self.cull_margin = margin
+		culled = []
+		for ctype, components in sorted(self.card_types.items()):
+			mask = cairo.ImageSurface(
+				cairo.FORMAT_A8, int(self.width), int(self.height))
+			ctx = cairo.Context(mask)
+			above = []
+			keep = []
+			for c in reversed(components):
+				extent = component_extent(c)
+				if above and extent and covered(mask, extent, margin):
+					culled.append({
+						"type": ctype, "component": c.name, "layer": c.layer,
+						"coveredBy": list(above)
+					})
+				else:
+					keep.append(c)
+				if (c.type in ALWAYS_DRAWN and c.image and not c.clip
+						and "default" in c.image.paths):
+					img = cairo.ImageSurface.create_from_png(c.image.paths["default"])
+					draw_surface_at(ctx, img, c.image.x, c.image.y, c.image.width, c.image.height)
+					img.finish()
+					mask.flush()
+					above.append(c.name)
+			keep.reverse()
+			self.card_types[ctype] = keep
+			mask.finish()
+		self.culled.extend(culled)
+		return culled
+
+	def culling_report(self):
+		return ["{type}.{component} (layer {layer}) hidden by {covers}".format(
+			covers=", ".join(c["coveredBy"]), **c) for c in self.culled]
+
+	def validate(self):
+		if self.errors:
+			raise ThemeError(self.name, self.errors)
+
+	def components(self, card_type):
+		"""The layer sorted components of a card type, None if unsupported."""
+		return self.card_types.get(card_type)
+
+	def decode_assets(self):
+		"""Pre-decode every image asset, to be saved in a bundle."""
+		for components in self.card_types.values():
+			for c in components:
+				if not c.image:
+					continue
+				for path in c.image.paths.values():
+					if path in self.decoded:
+						continue
+					img = cairo.ImageSurface.create_from_png(path)
+					img.flush()
+					# writable, so surfaces wrap the data rather than copy it
+					self.decoded[path] = (
+						int(img.get_format()), img.get_width(), img.get_height(),
+						img.get_stride(), bytearray(img.get_data()))
+					img.finish()
+
+	def warm_surfaces(self):
+		"""Wrap every pre-decoded asset as a surface, e.g. before forking
+		workers, so they share the surfaces and their data copy-on-write
+		rather than each making its own."""
+		for path in self.decoded:
+			self._surface(path)
+
+	def get(self, file, size=None):
+		"""Get the pre-decoded surface of an asset file, None if there isn't one."""
+		return self._surface(os.path.normpath(os.path.join(self.dir, file)))
+
+	def _surface(self, path):
+		if path in self._surfaces:
+			return self._surfaces[path]
+		surface = None
+		if path in self.decoded:
+			fmt, width, height, stride, data = self.decoded[path]
+			surface = cairo.ImageSurface.create_for_data(
+				data, cairo.Format(fmt), width, height, stride)
+		self._surfaces[path] = surface
+		return surface
+
+	def discard(self, path):
+		"""Forget the pre-decoded copy of an asset, e.g. after it changes."""
+		path = os.path.normpath(path)
+		self.decoded.pop(path, None)
+		self._surfaces.pop(path, None)
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state["_surfaces"] = {}
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self._compile_clips()
+
+	def __str__(self):
+		return "{} ({} card types, {} decoded assets)".format(
+			self.name, len(self.card_types), len(self.decoded))
+
+
+def component_extent(c):
+	"""The (x, y, width, height) a component can draw in, None if unknown."""
+	if c.custom:
+		return None
+	rects = []
+	for region in (c.image, c.text):
+		if region:
+			rects.append((region.x, region.y, region.x + region.width, region.y + region.height))
+	if c.curve:
+		# a bezier is within the hull of its points, text extends off the curve
+		pts = (c.curve.start, c.curve.c1, c.curve.c2, c.curve.end)
+		pad = c.font.size if c.font and c.font.size else 0
+		rects.append((
+			min(p.x for p in pts) - pad, min(p.y for p in pts) - pad,
+			max(p.x for p in pts) + pad, max(p.y for p in pts) + pad))
+	if not rects:
+		return None
+	x0, y0 = min(r[0] for r in rects), min(r[1] for r in rects)
+	x1, y1 = max(r[2] for r in rects), max(r[3] for r in rects)
+	return (x0, y0, x1 - x0, y1 - y0)
+
+
+def covered(mask, extent, margin=0):
+	"""Check if a region of an A8 mask is fully opaque."""
+	x, y, w, h = extent
+	x0, y0 = int(x) - margin, int(y) - margin
+	x1, y1 = int(math.ceil(x + w)) + margin, int(math.ceil(y + h)) + margin
+	if x0 < 0 or y0 < 0 or x1 > mask.get_width() or y1 > mask.get_height():
+		return False
+	data = mask.get_data()
+	stride = mask.get_stride()
+	for row in range(y0, y1):
+		if bytes(data[row * stride + x0:row * stride + x1]).strip(b"\xff"):
+			return False
+	return True
+
+
+def compile_theme(theme_dir, font_map=None, decode=False, cull=False):
+	theme = Theme(theme_dir, load_theme_json(theme_dir), font_map)
+	if cull and not theme.errors:
+		theme.cull()
+	if decode and not theme.errors:
+		theme.decode_assets()
+	return theme
+
+
+def json_stamp(theme_dir):
+	stat = os.stat(os.path.join(theme_dir, THEME_JSON))
+	return (stat.st_mtime_ns, stat.st_size)
+
+
+def save_bundle(theme, path):
+	"""Save a validated theme to a bundle file."""
+	theme.validate()
+	os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+	bundle = {
+		"version": BUNDLE_VERSION,
+		"stamp": json_stamp(theme.dir),
+		"theme": theme
+	}
+	with open(path, "wb") as f:
+		pickle.dump(bundle, f, pickle.HIGHEST_PROTOCOL)
+
+
+def load_bundle(path, font_map=None):
+	"""Load a compiled theme bundle, applying any font replacements."""
+	with open(path, "rb") as f:
+		bundle = pickle.load(f)
+	if bundle.get("version") != BUNDLE_VERSION:
+		raise ValueError("Theme bundle version mismatch ({}), recompile it".format(path))
+	theme = bundle["theme"]
+	if (os.path.isfile(os.path.join(theme.dir, THEME_JSON))
+			and json_stamp(theme.dir) != bundle["stamp"]):
+		print("Warning: theme bundle is older than its data ({})".format(path))
+	if font_map:
+		theme.font_map = font_map
+		for components in theme.card_types.values():
+			for c in components:
+				if c.font:
+					c.font.replace = font_map.get(c.font.family, c.font.replace)
+	return theme
@@ -0,0 +1,101 @@
+import os
+import os.path
+import time
+from .theme import card_types
+
+
+class Watcher:
+	"""Poll a set of files and directories for modifications."""
+	def __init__(self, paths):
+		self.paths = paths
+		self._stats = self._scan()
+
+	def poll(self):
+		"""Return the sorted list of paths modified, added or removed since
+		the last poll."""
+		stats = self._scan()
+		changed = set(stats.keys()) ^ set(self._stats.keys())
+		for path, stat in stats.items():
+			if path in self._stats and self._stats[path] != stat:
+				changed.add(path)
+		self._stats = stats
+		return sorted(changed)
+
+	def wait(self, interval=1.0):
+		"""Block until something changes, then wait for the writes to settle."""
+		changed = set()
+		while not changed:
+			time.sleep(interval)
+			changed.update(self.poll())
+		while True:
+			time.sleep(interval)
+			more = self.poll()
+			if not more:
+				break
+			changed.update(more)
+		return sorted(changed)
+
+	def _scan(self):
+		stats = {}
+		for path in self.paths:
+			if os.path.isdir(path):
+				self._scan_dir(path, stats)
+			elif os.path.isfile(path):
+				st = os.stat(path)
+				stats[os.path.normpath(path)] = (st.st_mtime_ns, st.st_size)
+		return stats
+
+	def _scan_dir(self, path, stats):
+		for entry in os.scandir(path):
+			if entry.is_dir():
+				if not entry.name.startswith("."):
+					self._scan_dir(entry.path, stats)
+			elif entry.is_file():
+				st = entry.stat()
+				stats[os.path.normpath(entry.path)] = (st.st_mtime_ns, st.st_size)
+
+
+def changed_card_types(old, new):
+	"""Compare two versions of theme data, return the card types that differ.
+
+	All card types are returned when any of the shared settings change.
+	"""
+	types = card_types(old) | card_types(new)
+	shared = set(old.keys()) | set(new.keys())
+	for k in shared - types:
+		if old.get(k) != new.get(k):
+			return types
+	return set(t for t in types if old.get(t) != new.get(t))
+
+
+def _references(value, path):
+	"""Check if a file path or a directory containing it is used in value."""
+	if isinstance(value, str):
+		norm = os.path.normpath(value)
+		return path == norm or path.startswith(norm + os.sep)
+	elif isinstance(value, dict):
+		return any(_references(v, path) for v in value.values())
+	elif isinstance(value, list):
+		return any(_references(v, path) for v in value)
+	return False
+
+
+def asset_references(theme_data, path):
+	"""Find the components using a theme file, path is relative to the theme.
+
+	Returns a list of (card type, component name, asset key) tuples, the key
+	is None for custom components, which can use the file for any card.
+	"""
+	path = os.path.normpath(path)
+	refs = []
+	for ctype in card_types(theme_data):
+		for name, comp in theme_data[ctype].items():
+			img = comp.get("image")
+			if img:
+				for key, file in img.get("assets", {}).items():
+					if os.path.normpath(file) == path:
+						refs.append((ctype, name, key))
+			custom = comp.get("custom")
+			if custom and _references(custom, path):
+				refs.append((ctype, name, None))
+	return refs